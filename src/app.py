@@ -448,8 +448,8 @@ def initialize_systems():
         from models.rag_engine import RAGQueryEngine
         from models.vector_store import VectorStoreManager
         
-        rag_engine = RAGQueryEngine(use_local_embeddings=True)
-        vector_store = VectorStoreManager(use_local_embeddings=True)
+        rag_engine = RAGQueryEngine.get(use_local_embeddings=True)
+        vector_store = VectorStoreManager.get(use_local_embeddings=True)
         stats = vector_store.get_collection_stats()
         
         if stats.get("total_documents", 0) == 0:
@@ -978,7 +978,7 @@ Instructions: Respond warmly and naturally, like a nutrition coach would. Ask qu
             with st.spinner("Searching..."):
                 try:
                     from models.vector_store import VectorStoreManager
-                    vs = VectorStoreManager(use_local_embeddings=True)
+                    vs = VectorStoreManager.get(use_local_embeddings=True)
                     
                     filter_dict = None
                     if search_filter == "Foods Only":
@@ -22,10 +22,24 @@ class Settings:
         self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
         self.max_tokens = int(os.getenv("MAX_TOKENS", "2000"))
         self.temperature = float(os.getenv("TEMPERATURE", "0.7"))
+        self.openai_rpm_limit = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+        self.openai_tpm_limit = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+        self.quantize_embeddings = os.getenv("QUANTIZE_EMBEDDINGS", "False").lower() == "true"
         
         # RAG Configuration
         self.chunk_size = 1000
         self.chunk_overlap = 200
         self.top_k_results = 5
+        self.vector_index_backend = os.getenv("VECTOR_INDEX_BACKEND", "chroma")  # "chroma" or "faiss"
+        self.faiss_index_type = os.getenv("FAISS_INDEX_TYPE", "auto")  # "auto", "exact", "hnsw", "ivfpq" or "sq8"
+        self.chroma_search_ef = int(os.getenv("CHROMA_SEARCH_EF", "32"))
+        
+        # Semantic search cache
+        self.semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.semantic_cache_size = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+        self.query_embedding_cache_size = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+        
+        # RAG response cache (Redis tier is optional)
+        self.redis_url = os.getenv("REDIS_URL", "")
 
 settings = Settings()
\ No newline at end of file
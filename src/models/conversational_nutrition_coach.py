@@ -25,7 +25,7 @@ logger = logging.getLogger(__name__)
 class ConversationalNutritionCoach:
     def __init__(self, use_local_embeddings: bool = True):
         """Initialize conversational nutrition coach"""
-        self.vector_store = VectorStoreManager(use_local_embeddings)
+        self.vector_store = VectorStoreManager.get(use_local_embeddings)
         openai.api_key = settings.openai_api_key
         
         # Natural conversation system prompt
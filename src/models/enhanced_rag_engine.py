@@ -16,7 +16,7 @@ class ConversationalRAGEngine:
         """
         Initialize conversational RAG engine with memory
         """
-        self.vector_store = VectorStoreManager(use_local_embeddings)
+        self.vector_store = VectorStoreManager.get(use_local_embeddings)
         openai.api_key = settings.openai_api_key
         
         # Enhanced system prompt for conversational nutrition bot
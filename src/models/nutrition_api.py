@@ -5,15 +5,211 @@ Handles real-time nutrition data lookup for multimodal integration
 
 import requests
 import os
+import re
+import asyncio
+import functools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
+import diskcache
+import numpy as np
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of meal components looked up at the same time
+MAX_CONCURRENT_LOOKUPS = 10
+
+# Persistent cache of USDA responses, shared across runs
+USDA_CACHE_DIR = os.getenv("USDA_CACHE_DIR", str(Path(__file__).resolve().parents[2] / "data" / "usda_cache"))
+USDA_CACHE_SIZE_LIMIT = 256 << 20
+USDA_CACHE_EXPIRE = 7 * 24 * 60 * 60
+
+# Keep-alive HTTP session shared by all lookups, so TLS handshakes happen once per pooled
+# connection; transient 429/5xx responses are retried with exponential backoff.
+# One pool for the single USDA host, sized to the lookup concurrency and blocking when
+# exhausted, so bursts wait for a warm connection instead of opening throwaway ones
+USDA_TIMEOUT = 5
+USDA_POOL_SIZE = MAX_CONCURRENT_LOOKUPS
+_retry = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET"}),
+    raise_on_status=False
+)
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=1, pool_maxsize=USDA_POOL_SIZE, pool_block=True, max_retries=_retry
+))
+
+# Opened on first use, so importing this module never touches the filesystem.
+# Entries are keyed by endpoint (base_url) but not API key: any key returns the
+# same public data, and keeping keys out of the cache keeps them off disk.
+_disk_cache: Optional[diskcache.Cache] = None
+_disk_cache_lock = threading.Lock()
+
+def _get_disk_cache() -> diskcache.Cache:
+    """Return the on-disk USDA response cache, opening it on first use"""
+    global _disk_cache
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                cache = diskcache.Cache(USDA_CACHE_DIR, size_limit=USDA_CACHE_SIZE_LIMIT)
+                cache.stats(enable=True)
+                _disk_cache = cache
+    return _disk_cache
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+@functools.lru_cache(maxsize=4096)
+def _search_foods_cached(base_url: str, api_key: str, query: str, max_results: int) -> Tuple[Dict, ...]:
+    """
+    USDA food search memoized in memory (LRU) and on disk
+    
+    Raises on request errors, so fallback sample data is never cached.
+    """
+    disk_cache = _get_disk_cache()
+    key = ("search", base_url, query, max_results)
+    foods = disk_cache.get(key)
+    if foods is None:
+        params = {
+            'query': query,
+            'dataType': 'Foundation,SR Legacy',
+            'pageSize': max_results,
+            'api_key': api_key
+        }
+        
+        response = _session.get(f"{base_url}/foods/search", params=params, timeout=USDA_TIMEOUT)
+        response.raise_for_status()
+        
+        data = response.json()
+        foods = []
+        
+        for food in data.get('foods', []):
+            food_info = {
+                'fdc_id': food.get('fdcId'),
+                'description': food.get('description', ''),
+                'data_type': food.get('dataType', ''),
+                'food_category': food.get('foodCategory', ''),
+                'score': food.get('score', 0)
+            }
+            foods.append(food_info)
+        
+        disk_cache.set(key, foods, expire=USDA_CACHE_EXPIRE)
+    
+    return tuple(foods)
+
+@functools.lru_cache(maxsize=1024)
+def _food_details_cached(base_url: str, api_key: str, fdc_id: int) -> Dict:
+    """
+    Parsed USDA food details memoized in memory (LRU) and on disk
+    
+    Raises on request errors, so fallback sample data is never cached.
+    """
+    disk_cache = _get_disk_cache()
+    key = ("food", base_url, fdc_id)
+    details = disk_cache.get(key)
+    if details is None:
+        response = _session.get(f"{base_url}/food/{fdc_id}", params={'api_key': api_key}, timeout=USDA_TIMEOUT)
+        response.raise_for_status()
+        
+        details = USDANutritionAPI._parse_nutrition_data(response.json())
+        disk_cache.set(key, details, expire=USDA_CACHE_EXPIRE)
+    
+    return details
+
+def cache_stats() -> Dict:
+    """Hit/miss counters of the in-memory and on-disk USDA caches"""
+    search = _search_foods_cached.cache_info()
+    details = _food_details_cached.cache_info()
+    # Don't create the cache just to report on it
+    disk_hits, disk_misses = _disk_cache.stats() if _disk_cache is not None else (0, 0)
+    memory_hits = search.hits + details.hits
+    lookups = memory_hits + search.misses + details.misses
+    return {
+        'memory_hits': memory_hits,
+        'disk_hits': disk_hits,
+        'misses': disk_misses,
+        'hit_rate': (memory_hits + disk_hits) / lookups if lookups else 0.0,
+        'search_cache': search._asdict(),
+        'details_cache': details._asdict()
+    }
+
+def clear_cache():
+    """Drop all cached USDA responses, in memory and on disk"""
+    _search_foods_cached.cache_clear()
+    _food_details_cached.cache_clear()
+    _get_disk_cache().clear()
+
+# Nutrients reported by _parse_nutrition_data, in a fixed column order for vectorized scaling
+NUTRIENT_KEYS = (
+    'calories', 'protein_g', 'carbohydrates_g', 'total_fat_g', 'fiber_g',
+    'vitamin_c_mg', 'calcium_mg', 'iron_mg', 'sodium_mg'
+)
+
+def _scale_nutrients(nutrients: List[Dict], grams: List[float]) -> List[Dict]:
+    """
+    Scale per-100g nutrient dicts to portion weights in one array multiply
+    
+    Nutrients missing from (or non-numeric in) a base dict are left out of its result.
+    """
+    base = np.array(
+        [[row[key] if isinstance(row.get(key), (int, float)) else np.nan for key in NUTRIENT_KEYS]
+         for row in nutrients],
+        dtype=np.float64
+    ).reshape(len(nutrients), len(NUTRIENT_KEYS))
+    scaled = np.round(base * (np.asarray(grams, dtype=np.float64) / 100.0)[:, None], 2)
+    present = ~np.isnan(scaled)
+    
+    return [
+        {key: value for key, value, keep in zip(NUTRIENT_KEYS, row.tolist(), mask) if keep}
+        for row, mask in zip(scaled, present)
+    ]
+
+# Amount, unit and food name, e.g. "6oz chicken" or "1 cup broccoli"
+_PORTION_RE = re.compile(
+    r'(\d+(?:\.\d+)?)\s*'
+    r'(oz|ounces?|g|grams?|lbs?|pounds?'
+    r'|cups?|tbsp|tsp|tablespoons?|teaspoons?'
+    r'|pieces?|slices?|items?)\s+(.+)'
+)
+
+# Grams per unit; units not listed (pieces, slices, ...) are taken as grams
+_UNIT_G = {
+    'g': 1, 'gram': 1, 'grams': 1,
+    'oz': 28.35, 'ounce': 28.35, 'ounces': 28.35,
+    'lb': 453.6, 'lbs': 453.6, 'pound': 453.6, 'pounds': 453.6,
+    'tbsp': 15, 'tablespoon': 15, 'tablespoons': 15,
+    'tsp': 5, 'teaspoon': 5, 'teaspoons': 5
+}
+
+# Grams per cup for foods denser or lighter than water, checked in order
+_CUP_G = (
+    ('rice', 185),  # cooked rice
+    ('broccoli', 156)  # chopped broccoli
+)
+
+@functools.lru_cache(maxsize=4096)
+def _parse_portion_cached(description: str) -> Tuple[float, str, str]:
+    """(amount, unit, food name) of a meal component, memoized since meals repeat ingredients"""
+    # Simple parsing - could be enhanced with NLP
+    # Look for patterns like "6oz chicken" or "1 cup broccoli"
+    match = _PORTION_RE.match(description.lower().strip())
+    if match:
+        return float(match.group(1)), match.group(2), match.group(3).strip()
+    
+    # If no portion found, assume 100g serving
+    return 100, 'g', description.strip()
+
 class USDANutritionAPI:
     def __init__(self):
         self.api_key = os.getenv('USDA_API_KEY')
@@ -37,29 +233,9 @@ class USDANutritionAPI:
             return self._get_sample_foods(query)
         
         try:
-            url = f"{self.base_url}/foods/search"
-            params = {
-                'query': query,
-                'dataType': 'Foundation,SR Legacy',
-                'pageSize': max_results,
-                'api_key': self.api_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            foods = []
-            
-            for food in data.get('foods', []):
-                food_info = {
-                    'fdc_id': food.get('fdcId'),
-                    'description': food.get('description', ''),
-                    'data_type': food.get('dataType', ''),
-                    'food_category': food.get('foodCategory', ''),
-                    'score': food.get('score', 0)
-                }
-                foods.append(food_info)
+            cached = _search_foods_cached(self.base_url, self.api_key, _normalize_query(query), max_results)
+            # Copies, so callers cannot mutate cached entries
+            foods = [dict(food) for food in cached]
             
             logger.info(f"Found {len(foods)} foods for query: {query}")
             return foods
@@ -82,14 +258,9 @@ class USDANutritionAPI:
             return self._get_sample_nutrition(fdc_id)
         
         try:
-            url = f"{self.base_url}/food/{fdc_id}"
-            params = {'api_key': self.api_key}
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            food_data = response.json()
-            return self._parse_nutrition_data(food_data)
+            details = _food_details_cached(self.base_url, self.api_key, fdc_id)
+            # Copy, so callers cannot mutate the cached entry
+            return {**details, 'nutrients': dict(details['nutrients'])}
             
         except Exception as e:
             logger.error(f"Error getting food details for ID {fdc_id}: {e}")
@@ -99,118 +270,122 @@ class USDANutritionAPI:
         """
         Analyze multiple food components from a meal
         
+        Components are looked up concurrently. From async code, prefer awaiting
+        analyze_meal_components_async(); this method still works inside a running
+        event loop (Jupyter, async callers) by running on a worker thread.
+        
         Args:
             food_descriptions: List of food descriptions (e.g., ["6oz chicken breast", "1 cup broccoli"])
             
         Returns:
             List of analyzed food components with nutrition
         """
-        analyzed_foods = []
+        coroutine = self.analyze_meal_components_async(food_descriptions)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
         
-        for description in food_descriptions:
-            # Parse portion and food name
-            portion_info = self._parse_portion(description)
-            
-            # Search for the food
-            search_results = self.search_foods(portion_info['food_name'], max_results=3)
+        # asyncio.run() cannot nest inside a running loop, so give the coroutine its own thread and loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+    
+    async def analyze_meal_components_async(self, food_descriptions: List[str]) -> List[Dict]:
+        """
+        Analyze meal components concurrently, at most MAX_CONCURRENT_LOOKUPS at a time
+        
+        Args:
+            food_descriptions: List of food descriptions
             
-            if search_results:
-                # Get detailed nutrition for best match
-                best_match = search_results[0]
-                nutrition_details = self.get_food_details(best_match['fdc_id'])
-                
-                if nutrition_details:
-                    # Calculate nutrition for the specific portion
-                    portioned_nutrition = self._calculate_portion_nutrition(
-                        nutrition_details, 
-                        portion_info['amount'], 
-                        portion_info['unit']
-                    )
-                    
-                    analyzed_foods.append({
-                        'original_description': description,
-                        'food_name': best_match['description'],
-                        'portion': f"{portion_info['amount']} {portion_info['unit']}",
-                        'nutrition': portioned_nutrition,
-                        'confidence': best_match['score']
-                    })
+        Returns:
+            List of analyzed food components with nutrition, in input order
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
         
-        return analyzed_foods
-    
-    def _parse_portion(self, description: str) -> Dict:
-        """Parse portion size and food name from description"""
-        # Simple parsing - could be enhanced with NLP
-        import re
+        async def lookup(food_name: str) -> Optional[Tuple[Dict, Dict]]:
+            async with semaphore:
+                # USDA lookups are blocking HTTP calls, run them in worker threads
+                return await asyncio.to_thread(self._lookup_food, food_name)
         
-        # Look for patterns like "6oz chicken" or "1 cup broccoli"
-        portion_patterns = [
-            r'(\d+(?:\.\d+)?)\s*(oz|ounces?|g|grams?|lbs?|pounds?)\s+(.+)',
-            r'(\d+(?:\.\d+)?)\s*(cups?|cup|tbsp|tsp|tablespoons?|teaspoons?)\s+(.+)',
-            r'(\d+(?:\.\d+)?)\s*(pieces?|slices?|items?)\s+(.+)'
+        # Portion parsing is cheap, so do it up front and look up each distinct food once
+        # (concurrent lookups for the same name would all miss the cache together)
+        portions = [self._parse_portion(d) for d in food_descriptions]
+        food_names = list(dict.fromkeys(portion_info['food_name'] for portion_info in portions))
+        found = dict(zip(food_names, await asyncio.gather(*[lookup(name) for name in food_names])))
+        
+        lookups = [
+            (description, portion_info, *found[portion_info['food_name']])
+            for description, portion_info in zip(food_descriptions, portions)
+            if found[portion_info['food_name']] is not None
         ]
+        if not lookups:
+            return []
         
-        for pattern in portion_patterns:
-            match = re.match(pattern, description.lower().strip())
-            if match:
-                return {
-                    'amount': float(match.group(1)),
-                    'unit': match.group(2),
-                    'food_name': match.group(3).strip()
-                }
+        # Scale every component's nutrients to its portion in one vectorized pass
+        grams = [
+            self._convert_to_grams(portion_info['amount'], portion_info['unit'], details.get('food_name', ''))
+            for _, portion_info, _, details in lookups
+        ]
+        portioned = _scale_nutrients([details.get('nutrients', {}) for *_, details in lookups], grams)
         
-        # If no portion found, assume 100g serving
-        return {
-            'amount': 100,
-            'unit': 'g',
-            'food_name': description.strip()
-        }
+        return [
+            {
+                'original_description': description,
+                'food_name': best_match['description'],
+                'portion': f"{portion_info['amount']} {portion_info['unit']}",
+                'nutrition': portioned_nutrition,
+                'confidence': best_match['score']
+            }
+            for (description, portion_info, best_match, _), portioned_nutrition in zip(lookups, portioned)
+        ]
+    
+    def _lookup_food(self, food_name: str) -> Optional[Tuple[Dict, Dict]]:
+        """Best USDA match for a food name and its nutrition details"""
+        # Search for the food
+        search_results = self.search_foods(food_name, max_results=3)
+        
+        if not search_results:
+            return None
+        
+        # Get detailed nutrition for best match
+        best_match = search_results[0]
+        nutrition_details = self.get_food_details(best_match['fdc_id'])
+        
+        if not nutrition_details:
+            return None
+        
+        return best_match, nutrition_details
+    
+    def _parse_portion(self, description: str) -> Dict:
+        """Parse portion size and food name from description"""
+        amount, unit, food_name = _parse_portion_cached(description)
+        return {'amount': amount, 'unit': unit, 'food_name': food_name}
     
     def _calculate_portion_nutrition(self, base_nutrition: Dict, amount: float, unit: str) -> Dict:
         """Calculate nutrition for specific portion size"""
         # Convert to grams for calculation
         amount_in_grams = self._convert_to_grams(amount, unit, base_nutrition.get('food_name', ''))
         
-        # Base nutrition is per 100g, so calculate multiplier
-        multiplier = amount_in_grams / 100.0
-        
-        portioned_nutrition = {}
-        for nutrient, value in base_nutrition.get('nutrients', {}).items():
-            if isinstance(value, (int, float)):
-                portioned_nutrition[nutrient] = round(value * multiplier, 2)
-        
-        return portioned_nutrition
+        return _scale_nutrients([base_nutrition.get('nutrients', {})], [amount_in_grams])[0]
     
     def _convert_to_grams(self, amount: float, unit: str, food_name: str) -> float:
         """Convert various units to grams"""
         unit = unit.lower()
         
-        # Weight conversions
-        if unit in ['g', 'gram', 'grams']:
-            return amount
-        elif unit in ['oz', 'ounce', 'ounces']:
-            return amount * 28.35
-        elif unit in ['lb', 'lbs', 'pound', 'pounds']:
-            return amount * 453.6
-        
         # Volume conversions (approximate for common foods)
-        elif unit in ['cup', 'cups']:
+        if unit in ('cup', 'cups'):
             # Rough approximations - could be more food-specific
-            if 'rice' in food_name.lower():
-                return amount * 185  # cooked rice
-            elif 'broccoli' in food_name.lower():
-                return amount * 156  # chopped broccoli
-            else:
-                return amount * 240  # general liquid measure
-        
-        elif unit in ['tbsp', 'tablespoon', 'tablespoons']:
-            return amount * 15
-        elif unit in ['tsp', 'teaspoon', 'teaspoons']:
-            return amount * 5
+            food_name = food_name.lower()
+            for food, grams in _CUP_G:
+                if food in food_name:
+                    return amount * grams
+            return amount * 240  # general liquid measure
         
         # If unknown unit, assume it's already in grams
-        return amount
+        return amount * _UNIT_G.get(unit, 1)
     
-    def _parse_nutrition_data(self, food_data: Dict) -> Dict:
+    @staticmethod
+    def _parse_nutrition_data(food_data: Dict) -> Dict:
         """Parse USDA food data into our standard format"""
         nutrients = {}
         
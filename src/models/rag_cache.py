@@ -0,0 +1,122 @@
+"""
+Response cache for the RAG engine
+Two tiers: in-process TTL/LRU memory (L1) and optional Redis (L2)
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+import orjson
+import redis
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Generated answers stay valid for 4 hours
+RESPONSE_TTL = 4 * 60 * 60
+
+class RAGResponseCache:
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        ttl: int = RESPONSE_TTL,
+        redis_url: Optional[str] = None,
+        prefix: str = "rag:response:"
+    ):
+        """
+        Initialize response cache
+        
+        Args:
+            maxsize: Entries kept in memory before least-recently-used eviction
+            ttl: Seconds an entry stays valid in both tiers
+            redis_url: Redis connection URL; L2 is disabled when empty or unreachable
+            prefix: Namespace for Redis keys
+        """
+        self.ttl = ttl
+        self.prefix = prefix
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()  # cachetools caches are not thread-safe
+        
+        self._redis = None
+        if redis_url:
+            try:
+                self._redis = redis.Redis.from_url(redis_url)
+                self._redis.ping()
+                logger.info("Connected to Redis response cache")
+            except redis.RedisError as e:
+                logger.warning(f"Redis unavailable, using in-memory response cache only: {e}")
+                self._redis = None
+        
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(
+        query: str,
+        response_style: str,
+        model: str,
+        user_context: Optional[Dict] = None
+    ) -> str:
+        """Stable key for a request: normalized query, style, model and user context"""
+        normalized_query = " ".join(query.lower().split())
+        payload = orjson.dumps(
+            [normalized_query, response_style, model, user_context or {}],
+            option=orjson.OPT_SORT_KEYS,
+            default=str
+        )
+        return hashlib.sha256(payload).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a cached response, checking memory first and then Redis"""
+        with self._lock:
+            value = self._memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self.prefix + key)
+            except redis.RedisError as e:
+                logger.warning(f"Redis read failed: {e}")
+                raw = None
+            
+            if raw is not None:
+                value = orjson.loads(raw)
+                with self._lock:
+                    self._memory[key] = value
+                self.redis_hits += 1
+                return value
+        
+        self.misses += 1
+        return None
+    
+    def set(self, key: str, value: Dict):
+        """Store a response in both tiers"""
+        with self._lock:
+            self._memory[key] = value
+        
+        if self._redis is not None:
+            try:
+                self._redis.setex(self.prefix + key, self.ttl, orjson.dumps(value, default=str))
+            except redis.RedisError as e:
+                logger.warning(f"Redis write failed: {e}")
+    
+    def clear(self):
+        """Drop in-memory entries (Redis entries expire on their own)"""
+        with self._lock:
+            self._memory.clear()
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters for reporting"""
+        lookups = self.memory_hits + self.redis_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "redis_enabled": self._redis is not None
+        }
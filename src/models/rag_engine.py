@@ -1,28 +1,100 @@
 import openai
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
 from typing import List, Dict, Optional
 import logging
 import sys
 import os
+import random
+import threading
+import time
+from types import MappingProxyType
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models.vector_store import VectorStoreManager
+from models.rag_cache import RAGResponseCache
+from models.rate_limiter import RateLimiter, estimate_chat_tokens
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of in-flight OpenAI requests issued by the async path
+LLM_CONCURRENCY = 5
+
+# Attempts per LLM call when OpenAI still answers 429 despite client-side throttling
+LLM_MAX_RETRIES = 4
+
+# Returned when the LLM call fails; never cached
+LLM_ERROR_RESPONSE = "I apologize, but I'm currently unable to process your question due to a technical issue. Please try again in a moment."
+
+# Worker threads for the parallel retrieval branches, shared by every engine and request
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-retrieval")
+
 class RAGQueryEngine:
-    def __init__(self, use_local_embeddings: bool = True):
+    # Response style -> instruction appended to the user prompt
+    STYLE_INSTRUCTIONS = MappingProxyType({
+        "brief": "Provide a concise, direct answer in 2-3 sentences.",
+        "comprehensive": "Provide a thorough but accessible explanation with practical recommendations.",
+        "detailed": "Provide an in-depth response with detailed explanations, multiple options, and comprehensive guidance."
+    })
+    
+    # (user_context key, label) pairs in display order
+    _UC_FIELDS = (
+        ("age", "Age"),
+        ("gender", "Gender"),
+        ("activity_level", "Activity Level"),
+        ("goals", "Goals"),
+        ("dietary_restrictions", "Dietary Restrictions"),
+        ("preferences", "Food Preferences")
+    )
+    
+    # Process-wide instances keyed by use_local_embeddings, see get()
+    _instances: Dict[bool, "RAGQueryEngine"] = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, use_local_embeddings: bool = True) -> "RAGQueryEngine":
+        """Return the shared engine for this embedding backend, creating it on first use"""
+        instance = cls._instances.get(use_local_embeddings)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(use_local_embeddings)
+                if instance is None:
+                    instance = cls(use_local_embeddings)
+                    cls._instances[use_local_embeddings] = instance
+        return instance
+    
+    def __init__(
+        self,
+        use_local_embeddings: bool = True,
+        vector_store: Optional[VectorStoreManager] = None
+    ):
         """
         Initialize RAG query engine
         
         Args:
             use_local_embeddings: Whether to use local embeddings for vector search
+            vector_store: Existing vector store to search (defaults to the shared instance)
         """
-        self.vector_store = VectorStoreManager(use_local_embeddings)
+        self.vector_store = vector_store or VectorStoreManager.get(use_local_embeddings)
         openai.api_key = settings.openai_api_key
         
+        # Pace calls to stay under the account's RPM/TPM limits
+        self.rate_limiter = RateLimiter(settings.openai_rpm_limit, settings.openai_tpm_limit)
+        
+        # Repeated questions skip retrieval and the LLM call entirely
+        self.response_cache = RAGResponseCache(redis_url=settings.redis_url or None)
+        
+        # Async client and semaphore are bound to the event loop that uses them
+        self._async_client = None
+        self._llm_semaphore = None
+        self._async_loop = None
+        self._async_lock = threading.Lock()
+        
         # System prompt for nutrition bot
         self.system_prompt = """You are a professional nutrition tutor bot with expertise in dietetics, sports nutrition, and meal planning. Your role is to provide evidence-based, personalized nutrition guidance.
 
@@ -41,6 +113,11 @@ RESPONSE STRUCTURE:
 4. Any important disclaimers or considerations
 
 Remember: You complement but do not replace professional medical advice."""
+        
+        # Built once and reused so every request shares a byte-identical
+        # prefix, which lets OpenAI's prompt cache serve it. Per-request data
+        # (context, user profile, question) belongs in the user message only.
+        self._system_msg = {"role": "system", "content": self.system_prompt}
     
     def generate_response(
         self,
@@ -60,6 +137,11 @@ Remember: You complement but do not replace professional medical advice."""
             Dict with response, sources, and metadata
         """
         try:
+            cache_key = self.response_cache.make_key(query, response_style, settings.openai_model, user_context)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return self._copy_response(cached)
+            
             # Step 1: Analyze query to determine search strategy
             search_strategy = self._analyze_query(query)
             
@@ -74,12 +156,71 @@ Remember: You complement but do not replace professional medical advice."""
                 response_style
             )
             
+            result = {
+                "response": response,
+                "sources": [doc["metadata"] for doc in context_docs],
+                "search_strategy": search_strategy,
+                "context_count": len(context_docs)
+            }
+            if response != LLM_ERROR_RESPONSE:
+                self.response_cache.set(cache_key, result)
+            return self._copy_response(result)
+            
+        except Exception as e:
+            logger.error(f"Error generating RAG response: {e}")
             return {
+                "response": "I apologize, but I encountered an error processing your question. Please try rephrasing your query or contact support.",
+                "sources": [],
+                "error": str(e)
+            }
+    
+    async def agenerate_response(
+        self,
+        query: str,
+        user_context: Optional[Dict] = None,
+        response_style: str = "comprehensive"
+    ) -> Dict:
+        """
+        Async variant of generate_response so independent queries can be
+        issued concurrently (e.g. with asyncio.gather)
+        
+        Args:
+            query: User's question
+            user_context: Optional user information (age, goals, preferences, etc.)
+            response_style: "brief", "comprehensive", or "detailed"
+        
+        Returns:
+            Dict with response, sources, and metadata
+        """
+        try:
+            cache_key = self.response_cache.make_key(query, response_style, settings.openai_model, user_context)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return self._copy_response(cached)
+            
+            search_strategy = self._analyze_query(query)
+            
+            # Vector search is blocking, keep it off the event loop
+            context_docs = await asyncio.to_thread(
+                self._retrieve_context, query, search_strategy
+            )
+            
+            response = await self._agenerate_llm_response(
+                query,
+                context_docs,
+                user_context,
+                response_style
+            )
+            
+            result = {
                 "response": response,
                 "sources": [doc["metadata"] for doc in context_docs],
                 "search_strategy": search_strategy,
                 "context_count": len(context_docs)
             }
+            if response != LLM_ERROR_RESPONSE:
+                self.response_cache.set(cache_key, result)
+            return self._copy_response(result)
             
         except Exception as e:
             logger.error(f"Error generating RAG response: {e}")
@@ -89,6 +230,48 @@ Remember: You complement but do not replace professional medical advice."""
                 "error": str(e)
             }
     
+    @staticmethod
+    def _copy_response(response: Dict) -> Dict:
+        """Copy of a cached response that callers can modify without touching the cache"""
+        return {
+            **response,
+            "sources": [dict(source or {}) for source in response["sources"]],
+            "search_strategy": dict(response["search_strategy"])
+        }
+    
+    def generate_responses_batch(self, queries: List[Dict]) -> List[Dict]:
+        """
+        Answer several independent questions in one call
+        
+        The LLM requests are issued concurrently over one AsyncOpenAI client,
+        so they share its connection pool and finish in roughly one round-trip.
+        
+        Args:
+            queries: Dicts with "query" and optional "user_context" and "response_style"
+        
+        Returns:
+            List of response dicts, in the same order as queries
+        """
+        coroutine = self._agenerate_batch(queries)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        
+        # asyncio.run() cannot nest inside a running loop, so give the coroutine its own thread and loop
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+    
+    async def _agenerate_batch(self, queries: List[Dict]) -> List[Dict]:
+        return await asyncio.gather(*[
+            self.agenerate_response(
+                q["query"],
+                user_context=q.get("user_context"),
+                response_style=q.get("response_style", "comprehensive")
+            )
+            for q in queries
+        ])
+    
     def _analyze_query(self, query: str) -> Dict:
         """Analyze query to determine optimal search strategy"""
         query_lower = query.lower()
@@ -130,53 +313,63 @@ Remember: You complement but do not replace professional medical advice."""
     
     def _retrieve_context(self, query: str, strategy: Dict) -> List[Dict]:
         """Retrieve relevant context based on search strategy"""
-        all_results = []
+        vs = self.vector_store
+        
+        # Encode the query once and share it with every branch searching it verbatim
+        query_embedding = vs.embed_queries([query])[0].tolist()
         
         # Base search
-        base_results = self.vector_store.similarity_search(query, n_results=5)
-        all_results.extend(base_results)
+        tasks = [partial(vs.similarity_search, query, n_results=5, query_embedding=query_embedding)]
         
         # Focused searches based on strategy
         if strategy["food_focus"]:
-            food_results = self.vector_store.hybrid_search(
-                query, n_results=3, food_focus=True
-            )
-            all_results.extend(food_results)
+            tasks.append(partial(
+                vs.hybrid_search, query, n_results=3, food_focus=True, query_embedding=query_embedding
+            ))
         
         if strategy["knowledge_focus"]:
-            knowledge_results = self.vector_store.hybrid_search(
-                query, n_results=3, knowledge_focus=True
-            )
-            all_results.extend(knowledge_results)
+            tasks.append(partial(
+                vs.hybrid_search, query, n_results=3, knowledge_focus=True, query_embedding=query_embedding
+            ))
         
         if strategy["sports_nutrition_focus"]:
-            sports_results = self.vector_store.similarity_search(
+            tasks.append(partial(
+                vs.similarity_search,
                 f"sports nutrition exercise {query}",
                 n_results=2,
                 filter_dict={"category": "Sports Nutrition"}
-            )
-            all_results.extend(sports_results)
+            ))
         
-        # Remove duplicates and keep top results
-        seen_ids = set()
-        unique_results = []
+        all_results = []
+        if len(tasks) == 1:
+            all_results.extend(tasks[0]())
+        else:
+            # Chroma's backend releases the GIL, so the branches query in parallel.
+            # Merge in submission order so ties sort the same way on every run
+            # (the context, and with it the prompt and cache key, stay stable).
+            futures = [_retrieval_executor.submit(task) for task in tasks]
+            for future in futures:
+                all_results.extend(future.result())
+        
+        # Remove duplicates (keeping the best score per id) and drop weak matches
+        best = {}
         for result in all_results:
-            if result["id"] not in seen_ids and result["similarity"] > 0.3:
-                unique_results.append(result)
-                seen_ids.add(result["id"])
+            if result["similarity"] > 0.3 and (
+                result["id"] not in best or result["similarity"] > best[result["id"]]["similarity"]
+            ):
+                best[result["id"]] = result
         
         # Sort by relevance and limit results
-        unique_results.sort(key=lambda x: x["similarity"], reverse=True)
-        return unique_results[:8]  # Limit context to avoid token limits
+        return sorted(best.values(), key=itemgetter("similarity"), reverse=True)[:8]  # Limit context to avoid token limits
     
-    def _generate_llm_response(
-        self, 
-        query: str, 
+    def _build_messages(
+        self,
+        query: str,
         context_docs: List[Dict],
         user_context: Optional[Dict],
         response_style: str
-    ) -> str:
-        """Generate response using OpenAI with retrieved context"""
+    ) -> List[Dict]:
+        """Build the chat messages for a query and its retrieved context"""
         
         # Build context string
         context_str = self._build_context_string(context_docs)
@@ -187,13 +380,7 @@ Remember: You complement but do not replace professional medical advice."""
             user_context_str = f"\nUSER CONTEXT:\n{self._format_user_context(user_context)}\n"
         
         # Adjust prompt based on response style
-        style_instructions = {
-            "brief": "Provide a concise, direct answer in 2-3 sentences.",
-            "comprehensive": "Provide a thorough but accessible explanation with practical recommendations.",
-            "detailed": "Provide an in-depth response with detailed explanations, multiple options, and comprehensive guidance."
-        }
-        
-        style_instruction = style_instructions.get(response_style, style_instructions["comprehensive"])
+        style_instruction = self.STYLE_INSTRUCTIONS.get(response_style, self.STYLE_INSTRUCTIONS["comprehensive"])
         
         # Create the full prompt
         user_prompt = f"""CONTEXT FROM NUTRITION DATABASE:
@@ -205,22 +392,105 @@ RESPONSE STYLE: {style_instruction}
 
 Please provide a helpful, evidence-based response using the context provided above."""
         
+        return [
+            self._system_msg,
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _generate_llm_response(
+        self, 
+        query: str, 
+        context_docs: List[Dict],
+        user_context: Optional[Dict],
+        response_style: str
+    ) -> str:
+        """Generate response using OpenAI with retrieved context"""
+        messages = self._build_messages(query, context_docs, user_context, response_style)
+        
         try:
-            response = openai.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=settings.max_tokens,
-                temperature=settings.temperature
-            )
+            return self._call_llm(messages)
             
-            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Error calling OpenAI API: {e}")
+            return LLM_ERROR_RESPONSE
+    
+    def _call_llm(self, messages: List[Dict]) -> str:
+        """Chat completion throttled by the rate limiter, with backoff on 429s"""
+        tokens = estimate_chat_tokens(messages, settings.openai_model, settings.max_tokens)
+        
+        for attempt in range(LLM_MAX_RETRIES):
+            self.rate_limiter.acquire(tokens)
+            try:
+                response = openai.chat.completions.create(
+                    model=settings.openai_model,
+                    messages=messages,
+                    max_tokens=settings.max_tokens,
+                    temperature=settings.temperature
+                )
+                return response.choices[0].message.content
+            except openai.RateLimitError:
+                if attempt == LLM_MAX_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt + random.random())
+    
+    async def _get_async_llm(self):
+        """Return the AsyncOpenAI client and semaphore for the running event loop"""
+        loop = asyncio.get_running_loop()
+        stale_client = None
+        # Loops on different threads (e.g. generate_responses_batch) may swap concurrently
+        with self._async_lock:
+            if self._async_loop is not loop:
+                stale_client = self._async_client
+                self._async_client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
+                self._llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+                self._async_loop = loop
+            client, semaphore = self._async_client, self._llm_semaphore
+        
+        # Release the previous loop's connection pool instead of leaking it
+        if stale_client is not None:
+            try:
+                await stale_client.close()
+            except Exception as e:
+                logger.warning(f"Error closing previous AsyncOpenAI client: {e}")
+        return client, semaphore
+    
+    async def _agenerate_llm_response(
+        self,
+        query: str,
+        context_docs: List[Dict],
+        user_context: Optional[Dict],
+        response_style: str
+    ) -> str:
+        """Async OpenAI call, bounded by LLM_CONCURRENCY in-flight requests"""
+        messages = self._build_messages(query, context_docs, user_context, response_style)
+        
+        try:
+            return await self._acall_llm(messages)
             
         except Exception as e:
             logger.error(f"Error calling OpenAI API: {e}")
-            return f"I apologize, but I'm currently unable to process your question due to a technical issue. Please try again in a moment."
+            return LLM_ERROR_RESPONSE
+    
+    async def _acall_llm(self, messages: List[Dict]) -> str:
+        """Async variant of _call_llm"""
+        client, semaphore = await self._get_async_llm()
+        tokens = estimate_chat_tokens(messages, settings.openai_model, settings.max_tokens)
+        
+        for attempt in range(LLM_MAX_RETRIES):
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                async with semaphore:
+                    response = await client.chat.completions.create(
+                        model=settings.openai_model,
+                        messages=messages,
+                        max_tokens=settings.max_tokens,
+                        temperature=settings.temperature
+                    )
+                return response.choices[0].message.content
+            except openai.RateLimitError:
+                if attempt == LLM_MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt + random.random())
     
     def _build_context_string(self, context_docs: List[Dict]) -> str:
         """Build formatted context string from retrieved documents"""
@@ -248,22 +518,11 @@ Please provide a helpful, evidence-based response using the context provided abo
     
     def _format_user_context(self, user_context: Dict) -> str:
         """Format user context information"""
-        context_parts = []
-        
-        if "age" in user_context:
-            context_parts.append(f"Age: {user_context['age']}")
-        if "gender" in user_context:
-            context_parts.append(f"Gender: {user_context['gender']}")
-        if "activity_level" in user_context:
-            context_parts.append(f"Activity Level: {user_context['activity_level']}")
-        if "goals" in user_context:
-            context_parts.append(f"Goals: {user_context['goals']}")
-        if "dietary_restrictions" in user_context:
-            context_parts.append(f"Dietary Restrictions: {user_context['dietary_restrictions']}")
-        if "preferences" in user_context:
-            context_parts.append(f"Food Preferences: {user_context['preferences']}")
-        
-        return " | ".join(context_parts)
+        return " | ".join(
+            f"{label}: {user_context[key]}"
+            for key, label in self._UC_FIELDS
+            if key in user_context
+        )
     
     def get_food_recommendations(
         self, 
@@ -309,12 +568,12 @@ Please provide a helpful, evidence-based response using the context provided abo
             "total_foods": sum(len(foods) for foods in recommendations_by_category.values())
         }
 
-def test_rag_engine():
+async def test_rag_engine():
     """Test the RAG engine functionality"""
     print("🧪 Testing RAG Engine...")
     
     # Initialize RAG engine
-    rag = RAGQueryEngine(use_local_embeddings=True)
+    rag = RAGQueryEngine.get(use_local_embeddings=True)
     
     # Test queries
     test_queries = [
@@ -332,14 +591,18 @@ def test_rag_engine():
         }
     ]
     
-    for i, test in enumerate(test_queries, 1):
-        print(f"\n🔍 Test {i}: {test['query']}")
-        
-        result = rag.generate_response(
-            test["query"], 
+    # Queries are independent, so issue them concurrently
+    results = await asyncio.gather(*[
+        rag.agenerate_response(
+            test["query"],
             user_context=test.get("user_context"),
             response_style="comprehensive"
         )
+        for test in test_queries
+    ])
+    
+    for i, (test, result) in enumerate(zip(test_queries, results), 1):
+        print(f"\n🔍 Test {i}: {test['query']}")
         
         print(f"📊 Found {result['context_count']} relevant sources")
         print(f"🎯 Search strategy: {result['search_strategy']}")
@@ -354,4 +617,4 @@ def test_rag_engine():
     print("\n✅ RAG engine test completed!")
 
 if __name__ == "__main__":
-    test_rag_engine()
\ No newline at end of file
+    asyncio.run(test_rag_engine())
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Client-side rate limiting for OpenAI requests
+Token buckets for requests and tokens per minute, so calls wait just
+before the limits are reached instead of triggering 429 retries
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=8)
+def _encoding_for(model: str):
+    """tiktoken encoding for model, or None when it cannot be loaded (e.g. offline)"""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The BPE file is downloaded on first use; remember the failure instead of retrying per call
+        logger.warning(f"tiktoken encoding unavailable, estimating tokens from characters: {e}")
+        return None
+
+def estimate_chat_tokens(messages: List[Dict], model: str, max_tokens: int = 0) -> int:
+    """Approximate tokens a chat request consumes against the TPM limit (prompt + completion budget)"""
+    encoding = _encoding_for(model)
+    if encoding is None:
+        # ~4 characters per token
+        return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+    
+    # ~4 tokens of framing per message plus 2 for the reply primer
+    prompt_tokens = sum(len(encoding.encode(m["content"])) + 4 for m in messages) + 2
+    return prompt_tokens + max_tokens
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        Initialize rate limiter
+        
+        Args:
+            requests_per_minute: Request budget (RPM); refilled continuously
+            tokens_per_minute: Token budget (TPM); refilled continuously
+        """
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self._available_requests = self.request_capacity
+        self._available_tokens = self.token_capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        
+        # Total time callers spent waiting for capacity
+        self.wait_time_s = 0.0
+    
+    def _try_acquire(self, tokens: int, requests: int) -> float:
+        """Take capacity if available, otherwise record and return seconds until it will be"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_refill
+            self._last_refill = now
+            
+            self._available_requests = min(
+                self.request_capacity,
+                self._available_requests + elapsed * self.request_capacity / 60
+            )
+            self._available_tokens = min(
+                self.token_capacity,
+                self._available_tokens + elapsed * self.token_capacity / 60
+            )
+            
+            # A single oversized request can never exceed a full bucket
+            tokens = min(tokens, self.token_capacity)
+            
+            if self._available_requests >= requests and self._available_tokens >= tokens:
+                self._available_requests -= requests
+                self._available_tokens -= tokens
+                return 0.0
+            
+            wait = max(
+                (requests - self._available_requests) * 60 / self.request_capacity,
+                (tokens - self._available_tokens) * 60 / self.token_capacity,
+                0.0
+            )
+            self.wait_time_s += wait
+            return wait
+    
+    def acquire(self, tokens: int, requests: int = 1):
+        """Block until the request fits within both budgets"""
+        while True:
+            wait = self._try_acquire(tokens, requests)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+    
+    async def aacquire(self, tokens: int, requests: int = 1):
+        """Async variant of acquire that yields to the event loop while waiting"""
+        while True:
+            wait = self._try_acquire(tokens, requests)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
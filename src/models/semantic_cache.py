@@ -0,0 +1,139 @@
+"""
+Semantic cache for vector search results
+Reuses results of earlier queries whose embeddings are near-identical
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+class SemanticCache:
+    """
+    LRU cache keyed by query embedding rather than query text.
+    
+    Random-projection LSH narrows each lookup to a handful of candidate
+    entries; a candidate is a hit only if its cosine similarity with the
+    query is at least `similarity_threshold`.
+    """
+    
+    def __init__(
+        self,
+        dimension: int,
+        similarity_threshold: float = 0.95,
+        max_entries: int = 1024,
+        n_tables: int = 4,
+        n_bits: int = 16,
+        seed: int = 42
+    ):
+        """
+        Initialize semantic cache
+        
+        Args:
+            dimension: Embedding dimension
+            similarity_threshold: Minimum cosine similarity to reuse a cached result
+            max_entries: Number of entries kept before evicting the least recently used
+            n_tables: LSH tables probed per lookup (more tables, better recall)
+            n_bits: Hyperplanes per table (more bits, smaller buckets)
+        """
+        rng = np.random.default_rng(seed)
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        
+        self._planes = rng.standard_normal((n_tables, n_bits, dimension)).astype(np.float32)
+        self._bit_weights = np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64))
+        self._tables: List[Dict] = [{} for _ in range(n_tables)]
+        self._entries: OrderedDict = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _bucket_keys(self, vector: np.ndarray) -> List[int]:
+        """Sign pattern of the projections, packed into one integer per table"""
+        bits = (self._planes @ vector) > 0
+        return [int(key) for key in (bits * self._bit_weights).sum(axis=1)]
+    
+    def get(self, embedding, namespace: Hashable = None) -> Optional[List[Dict]]:
+        """
+        Look up results cached for a semantically equivalent query
+        
+        Args:
+            embedding: Query embedding
+            namespace: Extra key that must match exactly (e.g. n_results and filters)
+        
+        Returns:
+            Cached results, or None on a miss
+        """
+        vector = self._normalize(embedding)
+        keys = self._bucket_keys(vector)
+        
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, keys):
+                candidates.update(table.get((namespace, key), ()))
+            
+            best_id, best_similarity = None, self.similarity_threshold
+            for entry_id in candidates:
+                cached_vector, results, _ = self._entries[entry_id]
+                similarity = float(cached_vector @ vector)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            
+            if best_id is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][1]
+    
+    def set(self, embedding, results: List[Dict], namespace: Hashable = None):
+        """Store results for a query embedding"""
+        vector = self._normalize(embedding)
+        keys = self._bucket_keys(vector)
+        
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            
+            bucket_ids = [(namespace, key) for key in keys]
+            self._entries[entry_id] = (vector, results, bucket_ids)
+            for table, bucket_id in zip(self._tables, bucket_ids):
+                table.setdefault(bucket_id, set()).add(entry_id)
+            
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+    
+    def _evict_oldest(self):
+        entry_id, (_, _, bucket_ids) = self._entries.popitem(last=False)
+        for table, bucket_id in zip(self._tables, bucket_ids):
+            bucket = table.get(bucket_id)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[bucket_id]
+    
+    def clear(self):
+        """Drop all cached entries (e.g. after the collection is rebuilt)"""
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries)
+        }
@@ -1,23 +1,116 @@
-import json
+import hashlib
+import orjson
 import numpy as np
+from operator import itemgetter
 import pandas as pd
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import logging
+import sys
+import os
+import threading
+from cachetools import LRUCache
+
+# Must be set before chromadb is imported to keep telemetry out of the query path
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import torch
 from sentence_transformers import SentenceTransformer
 import chromadb
+import faiss
 from chromadb.config import Settings
 import openai
-import sys
-import os
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import settings
+from models.semantic_cache import SemanticCache
 
 logger = logging.getLogger(__name__)
 
+# FAISS HNSW graph parameters (used when settings.vector_index_backend == "faiss")
+FAISS_HNSW_M = 32
+FAISS_EF_CONSTRUCTION = 200
+FAISS_EF_SEARCH = 64
+
+# Corpora at least this large use IVF-PQ instead of HNSW; PQ training needs
+# thousands of vectors and only pays off once full vectors strain memory
+FAISS_IVFPQ_MIN_DOCS = 10_000
+FAISS_PQ_M = 16  # sub-quantizers, 384 / 16 = 24 dims each
+FAISS_PQ_BITS = 8
+FAISS_NPROBE = 8
+
+# Below this many documents the "auto" index is a brute-force matmul over the
+# memory-mapped fp16 embedding cache: exact, and faster than walking a graph
+EXACT_SEARCH_MAX_DOCS = 5_000
+
+# Documents embedded and added to ChromaDB per step in load_and_embed_documents()
+EMBED_BATCH_SIZE = 64
+
+# Embeddings are L2-normalized, so cosine space makes `1 - distance` a true cosine similarity
+# HNSW graph settings apply when the collection is (re)built by load_and_embed_documents()
+COLLECTION_METADATA = {
+    "description": "Nutrition knowledge base for RAG",
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": settings.chroma_search_ef
+}
+
+def _faiss_gpu_count() -> int:
+    """GPUs usable by FAISS (0 with faiss-cpu builds)"""
+    return faiss.get_num_gpus() if hasattr(faiss, "StandardGpuResources") else 0
+
+def _clean_metadata_value(value) -> str:
+    """Flatten a metadata value to the string form ChromaDB stores"""
+    return ", ".join(map(str, value)) if isinstance(value, list) else str(value)
+
+def _is_quantized(model: SentenceTransformer) -> bool:
+    """Whether the model runs dynamic int8 Linear layers (see _quantize_model)"""
+    return any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+
+def _quantize_model(model: SentenceTransformer) -> SentenceTransformer:
+    """Swap the encoder's Linear layers for dynamic int8 versions (CPU inference only)"""
+    logger.info("Quantizing embedding model to int8...")
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+# Local embedding model, loaded once per process and shared by all managers
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+_embedding_model: Optional[SentenceTransformer] = None
+_embedding_model_lock = threading.Lock()
+
+def _get_embedding_model() -> SentenceTransformer:
+    """Return the shared local embedding model, loading it on first use"""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                logger.info(f"Loading local embedding model on {device}...")
+                model = SentenceTransformer(LOCAL_EMBEDDING_MODEL, device=device)
+                # Dynamic int8 quantization only has CPU kernels
+                if settings.quantize_embeddings and device == "cpu":
+                    model = _quantize_model(model)
+                _embedding_model = model
+    return _embedding_model
+
 class VectorStoreManager:
+    # Process-wide instances keyed by use_local_embeddings, see get()
+    _instances: Dict[bool, "VectorStoreManager"] = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, use_local_embeddings: bool = True) -> "VectorStoreManager":
+        """Return the shared instance for this embedding backend, creating it on first use"""
+        instance = cls._instances.get(use_local_embeddings)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(use_local_embeddings)
+                if instance is None:
+                    instance = cls(use_local_embeddings)
+                    cls._instances[use_local_embeddings] = instance
+        return instance
+    
     def __init__(self, use_local_embeddings: bool = True):
         """
         Initialize vector store manager
@@ -31,8 +124,7 @@ class VectorStoreManager:
         
         # Initialize embedding model
         if use_local_embeddings:
-            logger.info("Loading local embedding model...")
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embedding_model = _get_embedding_model()
             self.embedding_dimension = 384
         else:
             logger.info("Using OpenAI embeddings...")
@@ -40,6 +132,17 @@ class VectorStoreManager:
             self.embedding_model = None
             self.embedding_dimension = 1536
         
+        # Exact-text query embeddings, so repeated queries skip the encoder
+        self._query_embeddings = LRUCache(maxsize=settings.query_embedding_cache_size)
+        self._query_embeddings_lock = threading.Lock()  # cachetools caches are not thread-safe
+        
+        # Reuse results for near-identical queries
+        self.search_cache = SemanticCache(
+            self.embedding_dimension,
+            similarity_threshold=settings.semantic_cache_threshold,
+            max_entries=settings.semantic_cache_size
+        )
+        
         # Initialize ChromaDB
         self.client = chromadb.PersistentClient(
             path="../data/chroma_db",
@@ -51,17 +154,251 @@ class VectorStoreManager:
         try:
             self.collection = self.client.get_collection(self.collection_name)
             logger.info(f"Loaded existing collection: {self.collection_name}")
+            
+            space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+            if space != COLLECTION_METADATA["hnsw:space"]:
+                logger.warning(
+                    f"Collection '{self.collection_name}' uses '{space}' distance; "
+                    "similarity scores assume cosine. Run load_and_embed_documents() to rebuild it."
+                )
         except Exception:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"description": "Nutrition knowledge base for RAG"}
-            )
+            self.collection = self._create_collection()
             logger.info(f"Created new collection: {self.collection_name}")
+        
+        # Optional in-memory FAISS index over the collection
+        self.faiss_index = None
+        self._gpu_index = None
+        self._exact_embeddings: Optional[np.ndarray] = None
+        self._faiss_docs: List[Tuple[str, str, Dict]] = []
+        self._faiss_postings: Dict[Tuple[str, str], np.ndarray] = {}
+        if settings.vector_index_backend == "faiss":
+            self._build_faiss_index()
+    
+    def _create_collection(self):
+        """Create the nutrition collection with the configured index settings"""
+        return self.client.create_collection(
+            name=self.collection_name,
+            metadata=COLLECTION_METADATA
+        )
+    
+    def _build_faiss_index(self):
+        """
+        Mirror the collection into a FAISS index (inner product == cosine on normalized vectors)
+        
+        With settings.faiss_index_type "auto", small corpora are searched exactly
+        with a matmul over the memory-mapped fp16 embedding cache, mid-sized ones get
+        an HNSW graph and large ones an IVF-PQ index that stores 16-byte codes
+        instead of full float32 vectors; "exact", "hnsw", "ivfpq" and "sq8" force a type.
+        
+        When FAISS sees a GPU, unfiltered exact and IVF-PQ searches go to a copy
+        of the index on the GPUs; HNSW and SQ8 have no GPU clone and stay on CPU.
+        """
+        self._exact_embeddings = None
+        self._gpu_index = None
+        docs, embeddings = self._load_index_embeddings()
+        if not docs:
+            self.faiss_index, self._faiss_docs, self._faiss_postings = None, [], {}
+            return
+        
+        n = len(embeddings)
+        index_type = settings.faiss_index_type
+        
+        if index_type == "exact" or (index_type == "auto" and n <= EXACT_SEARCH_MAX_DOCS):
+            index = None
+            kind = "exact"
+        elif index_type == "sq8":
+            # Exact scan over 8-bit codes: 4x less memory traffic than float32
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            index = faiss.IndexScalarQuantizer(
+                self.embedding_dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(embeddings)
+            index.add(embeddings)
+            kind = "SQ8"
+        elif index_type == "ivfpq" or (index_type == "auto" and n >= FAISS_IVFPQ_MIN_DOCS):
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            nlist = int(4 * np.sqrt(n))
+            quantizer = faiss.IndexFlatIP(self.embedding_dimension)
+            index = faiss.IndexIVFPQ(
+                quantizer, self.embedding_dimension, nlist, FAISS_PQ_M, FAISS_PQ_BITS, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(embeddings)
+            index.add(embeddings)
+            index.nprobe = FAISS_NPROBE
+            kind = f"IVF{nlist}-PQ{FAISS_PQ_M}"
+        else:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            index = faiss.IndexHNSWFlat(self.embedding_dimension, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = FAISS_EF_CONSTRUCTION
+            index.add(embeddings)
+            index.hnsw.efSearch = FAISS_EF_SEARCH
+            kind = "HNSW"
+        
+        # Posting lists of index positions per (metadata key, value), for filtered searches
+        postings: Dict[Tuple[str, str], List[int]] = {}
+        for position, (_, _, metadata) in enumerate(docs):
+            for item in (metadata or {}).items():
+                postings.setdefault(item, []).append(position)
+        
+        self.faiss_index = index
+        if index is None:
+            self._exact_embeddings = embeddings
+        self._faiss_docs = docs
+        self._faiss_postings = {item: np.asarray(positions, dtype=np.int64) for item, positions in postings.items()}
+        
+        if (index is None or isinstance(index, faiss.IndexIVF)) and _faiss_gpu_count() > 0:
+            cpu_index = index
+            if cpu_index is None:
+                cpu_index = faiss.IndexFlatIP(self.embedding_dimension)
+                cpu_index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+            try:
+                self._gpu_index = faiss.index_cpu_to_all_gpus(cpu_index)
+                kind += " (GPU)"
+            except RuntimeError as e:
+                logger.warning(f"Could not copy {kind} index to GPU, searching on CPU: {e}")
+        logger.info(f"Built {kind} index over {n} documents")
+    
+    def _index_manifest_file(self) -> Path:
+        """Which cached embedding matrix (and row order) the collection was last built from"""
+        return self.data_path / "embedding_cache" / "collection.json"
+    
+    def _save_index_manifest(self, cache_file: Path, ids: List[str]):
+        """Point later sessions at the fp16 cache file so they can memory-map it instead of reading ChromaDB"""
+        self._index_manifest_file().write_bytes(orjson.dumps({"embeddings": cache_file.name, "ids": ids}))
+    
+    def _load_index_embeddings(self) -> Tuple[List[Tuple[str, str, Dict]], Optional[np.ndarray]]:
+        """
+        (id, document, metadata) rows and their embedding matrix
+        
+        Memory-maps the fp16 embedding cache the collection was built from, as long
+        as the source documents and embedding model still hash to that same file;
+        otherwise pulls the embeddings out of ChromaDB.
+        """
+        manifest_file = self._index_manifest_file()
+        source_file = self.data_path / "comprehensive_documents.json"
+        if manifest_file.exists() and source_file.exists():
+            manifest = orjson.loads(manifest_file.read_bytes())
+            ids = manifest["ids"]
+            cache_file = self._embedding_cache_file(source_file.read_bytes())
+            if (manifest["embeddings"] == cache_file.name and cache_file.exists()
+                    and ids and len(ids) == self.collection.count()):
+                data = self.collection.get(ids=ids, include=["documents", "metadatas"])
+                rows = {doc_id: (doc_id, document, metadata) for doc_id, document, metadata
+                        in zip(data["ids"], data["documents"], data["metadatas"])}
+                embeddings = np.load(cache_file, mmap_mode="r")
+                if len(rows) == len(ids) and embeddings.shape == (len(ids), self.embedding_dimension):
+                    return [rows[doc_id] for doc_id in ids], embeddings
+            logger.warning("Cached embedding matrix does not match the collection, reading embeddings from ChromaDB")
+        
+        data = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            return [], None
+        docs = list(zip(data["ids"], data["documents"], data["metadatas"]))
+        return docs, np.asarray(data["embeddings"], dtype=np.float32)
+    
+    def _exact_search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        positions: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k inner products against the whole matrix (or the rows at positions), FAISS-style"""
+        embeddings = self._exact_embeddings if positions is None else self._exact_embeddings[positions]
+        scores = queries @ embeddings.T
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        
+        # argpartition finds the k best in linear time, then only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return top_scores, (top if positions is None else positions[top])
+    
+    def _faiss_filter_positions(self, filter_dict: Dict) -> Optional[np.ndarray]:
+        """Index positions matching an equality filter, or None if the filter needs ChromaDB's operators"""
+        positions = None
+        for key, value in filter_dict.items():
+            if key.startswith("$") or isinstance(value, (dict, list)):
+                return None
+            matches = self._faiss_postings.get((key, _clean_metadata_value(value)), np.empty(0, dtype=np.int64))
+            positions = matches if positions is None else np.intersect1d(positions, matches, assume_unique=True)
+        return positions
+    
+    def _faiss_search_params(self, selector=None, search_ef: Optional[int] = None):
+        if isinstance(self.faiss_index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.faiss_index.nprobe)
+        if isinstance(self.faiss_index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=search_ef or self.faiss_index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+    
+    def _query(
+        self,
+        query_embeddings: List,
+        n_results: int,
+        filter_dict: Optional[Dict],
+        search_ef: Optional[int] = None
+    ) -> Dict:
+        """
+        Nearest-neighbour query in ChromaDB's response layout
+        
+        Goes to the in-memory index when it is enabled (exact matmul or FAISS,
+        restricting equality filters to their posting lists); other filters
+        fall back to ChromaDB.
+        """
+        local_index = self.faiss_index is not None or self._exact_embeddings is not None
+        positions = None
+        if local_index and filter_dict:
+            positions = self._faiss_filter_positions(filter_dict)
+        
+        if not local_index or (filter_dict and positions is None):
+            return self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=filter_dict
+            )
+        
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if self._gpu_index is not None and positions is None:
+            # GPU indexes take no selectors, so only unfiltered searches go here
+            scores, indices = self._gpu_index.search(queries, n_results)
+        elif self._exact_embeddings is not None:
+            scores, indices = self._exact_search(queries, n_results, positions)
+        else:
+            params = None
+            selector = None
+            if positions is not None:
+                # Keep the selector referenced until the search returns
+                selector = faiss.IDSelectorBatch(positions)
+                params = self._faiss_search_params(selector, search_ef)
+            elif search_ef:
+                params = self._faiss_search_params(search_ef=search_ef)
+            scores, indices = self.faiss_index.search(queries, n_results, params=params)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row_scores, row_indices in zip(scores, indices):
+            hits = [(self._faiss_docs[i], score) for i, score in zip(row_indices, row_scores) if i >= 0]
+            results["ids"].append([doc[0] for doc, _ in hits])
+            results["documents"].append([doc[1] for doc, _ in hits])
+            results["metadatas"].append([doc[2] for doc, _ in hits])
+            results["distances"].append([1 - float(score) for _, score in hits])
+        return results
     
     def get_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Generate embeddings for list of texts"""
+        """Generate L2-normalized embeddings for list of texts"""
+        # Encode each distinct text once and scatter the rows back
+        if len(texts) > 1:
+            unique_texts, inverse = np.unique(texts, return_inverse=True)
+            if len(unique_texts) < len(texts):
+                return self.get_embeddings(unique_texts.tolist())[inverse]
+        
         if self.use_local_embeddings:
-            return self.embedding_model.encode(texts, convert_to_tensor=False)
+            # No autograd state, so concurrent encode calls from worker threads are safe
+            with torch.inference_mode():
+                return self.embedding_model.encode(
+                    texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True
+                )
         else:
             # Use OpenAI embeddings
             embeddings = []
@@ -76,48 +413,62 @@ class VectorStoreManager:
                     logger.error(f"Error getting OpenAI embedding: {e}")
                     # Fallback to zero vector
                     embeddings.append([0.0] * self.embedding_dimension)
-            return np.array(embeddings)
+            
+            embeddings = np.array(embeddings)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            return embeddings / np.where(norms == 0, 1.0, norms)
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeddings of search queries, encoding only those not seen before"""
+        with self._query_embeddings_lock:
+            cached = [self._query_embeddings.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, row in zip(queries, cached) if row is None))
+        
+        if missing:
+            encoded = dict(zip(missing, self.get_embeddings(missing)))
+            with self._query_embeddings_lock:
+                for query, row in encoded.items():
+                    row.flags.writeable = False  # rows are shared between callers
+                    self._query_embeddings[query] = row
+            cached = [encoded[query] if row is None else row for query, row in zip(queries, cached)]
+        
+        return np.stack(cached) if cached else np.empty((0, self.embedding_dimension), dtype=np.float32)
+    
+    def warm_query_cache(self, queries: List[str]):
+        """Encode known queries ahead of time (e.g. a fixed test or demo set)"""
+        self.embed_queries(queries)
     
     def load_and_embed_documents(self) -> bool:
         """Load documents and create embeddings"""
         try:
             # Load processed documents
-            with open(self.data_path / "comprehensive_documents.json", "r") as f:
-                documents = json.load(f)
+            source = (self.data_path / "comprehensive_documents.json").read_bytes()
+            documents = orjson.loads(source)
+            
+            # Hand Chroma unique ids in sorted order (first occurrence wins)
+            unique_docs = {}
+            for doc in documents:
+                unique_docs.setdefault(doc["id"], doc)
+            if len(unique_docs) != len(documents):
+                logger.warning(f"Dropped {len(documents) - len(unique_docs)} documents with duplicate ids")
+            documents = [unique_docs[doc_id] for doc_id in sorted(unique_docs)]
             
             logger.info(f"Loading {len(documents)} documents...")
             
             # Prepare data for embedding
-            texts = []
-            ids = []
-            metadatas = []
+            n = len(documents)
+            texts = [None] * n
+            ids = [None] * n
+            metadatas = [None] * n
             
-            for doc in documents:
-                texts.append(doc["content"])
-                ids.append(doc["id"])
+            for i, doc in enumerate(documents):
+                texts[i] = doc["content"]
+                ids[i] = doc["id"]
                 
                 # Clean metadata for ChromaDB (only string values)
-                clean_metadata = {}
-                for key, value in doc["metadata"].items():
-                    if isinstance(value, (str, int, float, bool)):
-                        clean_metadata[key] = str(value)
-                    elif isinstance(value, list):
-                        clean_metadata[key] = ", ".join(map(str, value))
-                    else:
-                        clean_metadata[key] = str(value)
-                
+                clean_metadata = {key: _clean_metadata_value(value) for key, value in doc["metadata"].items()}
                 clean_metadata["doc_type"] = doc["type"]
-                metadatas.append(clean_metadata)
-            
-            # Generate embeddings in batches
-            batch_size = 50
-            all_embeddings = []
-            
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                batch_embeddings = self.get_embeddings(batch_texts)
-                all_embeddings.extend(batch_embeddings.tolist())
-                logger.info(f"Embedded batch {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
+                metadatas[i] = clean_metadata
             
             # Clear existing collection
             try:
@@ -125,18 +476,41 @@ class VectorStoreManager:
             except:
                 pass
             
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"description": "Nutrition knowledge base for RAG"}
-            )
+            self.collection = self._create_collection()
+            self.search_cache.clear()
             
-            # Add to ChromaDB
-            self.collection.add(
-                embeddings=all_embeddings,
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+            # Reuse embeddings from a previous run over the same source and model
+            cache_file = self._embedding_cache_file(source)
+            cached = cache_file.exists()
+            if cached:
+                logger.info(f"Loading cached embeddings from {cache_file.name}")
+                all_embeddings = np.load(cache_file, mmap_mode="r").astype(np.float32)
+            else:
+                all_embeddings = np.empty((n, self.embedding_dimension), dtype=np.float32)
+            
+            # Embed and add to ChromaDB batch by batch, so only one batch is
+            # ever converted to the Python lists Chroma expects
+            n_batches = (n - 1) // EMBED_BATCH_SIZE + 1
+            for batch_number, i in enumerate(range(0, n, EMBED_BATCH_SIZE), start=1):
+                batch = slice(i, i + EMBED_BATCH_SIZE)
+                if not cached:
+                    all_embeddings[batch] = self.get_embeddings(texts[batch])
+                    logger.info(f"Embedded batch {batch_number}/{n_batches}")
+                
+                self.collection.add(
+                    embeddings=all_embeddings[batch].tolist(),
+                    documents=texts[batch],
+                    metadatas=metadatas[batch],
+                    ids=ids[batch]
+                )
+            
+            if not cached:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                np.save(cache_file, all_embeddings.astype(np.float16))
+            self._save_index_manifest(cache_file, ids)
+            
+            if settings.vector_index_backend == "faiss":
+                self._build_faiss_index()
             
             logger.info(f"Successfully embedded and stored {len(documents)} documents")
             return True
@@ -145,11 +519,23 @@ class VectorStoreManager:
             logger.error(f"Error loading and embedding documents: {e}")
             return False
     
+    def _embedding_cache_file(self, source: bytes) -> Path:
+        """fp16 embedding matrix path keyed by source documents and embedding model"""
+        if self.use_local_embeddings:
+            # The loaded model, not the setting: quantization is skipped on GPU
+            model_id = f"{LOCAL_EMBEDDING_MODEL}:{'int8' if _is_quantized(self.embedding_model) else 'fp32'}"
+        else:
+            model_id = settings.embedding_model
+        key = hashlib.sha256(source + model_id.encode()).hexdigest()[:16]
+        return self.data_path / "embedding_cache" / f"{key}.f16.npy"
+    
     def similarity_search(
         self, 
         query: str, 
         n_results: int = 5,
-        filter_dict: Optional[Dict] = None
+        filter_dict: Optional[Dict] = None,
+        query_embedding: Optional[List[float]] = None,
+        search_ef: Optional[int] = None
     ) -> List[Dict]:
         """
         Search for similar documents
@@ -158,59 +544,122 @@ class VectorStoreManager:
             query: Search query
             n_results: Number of results to return
             filter_dict: Optional filters (e.g., {"doc_type": "food_item"})
+            query_embedding: Precomputed embedding of query, skips re-encoding
+            search_ef: HNSW candidate list size for this query (higher = better recall,
+                       slower). Applies to the FAISS HNSW index; ChromaDB uses the
+                       collection's hnsw:search_ef (settings.chroma_search_ef).
         
         Returns:
             List of relevant documents with metadata
         """
         try:
             # Generate query embedding
-            query_embedding = self.get_embeddings([query])[0].tolist()
+            if query_embedding is None:
+                query_embedding = self.embed_queries([query])[0].tolist()
             
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                where=filter_dict
-            )
+            # Only the FAISS HNSW graph reads search_ef; elsewhere it must not split the cache
+            if search_ef is not None and not isinstance(self.faiss_index, faiss.IndexHNSW):
+                logger.warning(f"search_ef={search_ef} is ignored by the active vector index (FAISS HNSW only)")
+                search_ef = None
+            
+            cache_namespace = (n_results, self._filter_key(filter_dict), search_ef)
+            cached_results = self.search_cache.get(query_embedding, cache_namespace)
+            if cached_results is not None:
+                logger.info(f"Semantic cache hit for query: '{query}'")
+                return self._copy_results(cached_results)
             
-            # Format results
-            formatted_results = []
-            for i in range(len(results["documents"][0])):
-                result = {
-                    "content": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i],
-                    "similarity": 1 - results["distances"][0][i] if "distances" in results else 0.0,
-                    "id": results["ids"][0][i]
-                }
-                formatted_results.append(result)
+            results = self._query([query_embedding], n_results, filter_dict, search_ef)
+            
+            formatted_results = self._format_results(results, 0)
+            self.search_cache.set(query_embedding, formatted_results, cache_namespace)
             
             logger.info(f"Found {len(formatted_results)} relevant documents for query: '{query}'")
-            return formatted_results
+            return self._copy_results(formatted_results)
             
         except Exception as e:
             logger.error(f"Error in similarity search: {e}")
             return []
     
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        n_results: int = 5,
+        filter_dict: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        """
+        Search for several queries with one encoder pass and one index query
+        
+        Args:
+            queries: Search queries
+            n_results: Number of results to return per query
+            filter_dict: Optional filters applied to every query
+        
+        Returns:
+            One result list per query, in input order
+        """
+        try:
+            embeddings = self.embed_queries(queries)
+            cache_namespace = (n_results, self._filter_key(filter_dict), None)
+            
+            batch_results = [self.search_cache.get(embedding, cache_namespace) for embedding in embeddings]
+            misses = [i for i, cached in enumerate(batch_results) if cached is None]
+            
+            if misses:
+                results = self._query([embeddings[i].tolist() for i in misses], n_results, filter_dict)
+                for row, i in enumerate(misses):
+                    batch_results[i] = self._format_results(results, row)
+                    self.search_cache.set(embeddings[i], batch_results[i], cache_namespace)
+            
+            logger.info(f"Batch searched {len(queries)} queries ({len(queries) - len(misses)} cache hits)")
+            return [self._copy_results(query_results) for query_results in batch_results]
+            
+        except Exception as e:
+            logger.error(f"Error in batch similarity search: {e}")
+            return [[] for _ in queries]
+    
+    @staticmethod
+    def _format_results(results: Dict, row: int) -> List[Dict]:
+        """Convert one row of a ChromaDB query response into result dicts"""
+        formatted_results = []
+        for i in range(len(results["documents"][row])):
+            result = {
+                "content": results["documents"][row][i],
+                "metadata": results["metadatas"][row][i],
+                "similarity": 1 - results["distances"][row][i] if "distances" in results else 0.0,
+                "id": results["ids"][row][i]
+            }
+            formatted_results.append(result)
+        return formatted_results
+    
+    @staticmethod
+    def _copy_results(results: List[Dict]) -> List[Dict]:
+        """Copies of cached result dicts (and their metadata), so callers cannot mutate the cache"""
+        return [{**result, "metadata": dict(result["metadata"] or {})} for result in results]
+    
+    @staticmethod
+    def _filter_key(filter_dict: Optional[Dict]) -> Optional[bytes]:
+        """Hashable, order-independent form of a metadata filter"""
+        if not filter_dict:
+            return None
+        return orjson.dumps(filter_dict, option=orjson.OPT_SORT_KEYS)
+    
     def get_collection_stats(self) -> Dict:
         """Get statistics about the collection"""
         try:
             count = self.collection.count()
             
-            # Get sample of metadata to understand document types
-            sample_results = self.collection.query(
-                query_embeddings=[self.get_embeddings(["nutrition"])[0].tolist()],
-                n_results=min(20, count)
-            )
+            # Sample stored metadata to understand document types (no embedding or ANN work)
+            sample = self.collection.peek(limit=min(20, count))
             
             doc_types = {}
-            for metadata in sample_results["metadatas"][0]:
+            for metadata in sample["metadatas"]:
                 doc_type = metadata.get("doc_type", "unknown")
                 doc_types[doc_type] = doc_types.get(doc_type, 0) + 1
             
             return {
                 "total_documents": count,
                 "document_types": doc_types,
-                "embedding_model": "local (all-MiniLM-L6-v2)" if self.use_local_embeddings else "OpenAI",
+                "embedding_model": f"local ({LOCAL_EMBEDDING_MODEL})" if self.use_local_embeddings else "OpenAI",
                 "embedding_dimension": self.embedding_dimension
             }
         except Exception as e:
@@ -222,7 +671,8 @@ class VectorStoreManager:
         query: str, 
         n_results: int = 10,
         food_focus: bool = False,
-        knowledge_focus: bool = False
+        knowledge_focus: bool = False,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict]:
         """
         Advanced search that combines different document types intelligently
@@ -232,7 +682,11 @@ class VectorStoreManager:
             n_results: Total number of results
             food_focus: Prioritize food-related documents
             knowledge_focus: Prioritize knowledge/guideline documents
+            query_embedding: Precomputed embedding of query, shared by all sub-searches
         """
+        if query_embedding is None:
+            query_embedding = self.embed_queries([query])[0].tolist()
+        
         all_results = []
         
         if food_focus:
@@ -240,7 +694,8 @@ class VectorStoreManager:
             food_results = self.similarity_search(
                 query, 
                 n_results=max(2, n_results//2),
-                filter_dict={"doc_type": "food_item"}
+                filter_dict={"doc_type": "food_item"},
+                query_embedding=query_embedding
             )
             all_results.extend(food_results)
             
@@ -250,7 +705,8 @@ class VectorStoreManager:
                 other_results = self.similarity_search(
                     query,
                     n_results=remaining,
-                    filter_dict={"doc_type": {"$ne": "food_item"}}
+                    filter_dict={"doc_type": {"$ne": "food_item"}},
+                    query_embedding=query_embedding
                 )
                 all_results.extend(other_results)
         
@@ -259,7 +715,8 @@ class VectorStoreManager:
             knowledge_results = self.similarity_search(
                 query,
                 n_results=max(2, n_results//2),
-                filter_dict={"doc_type": "nutrition_knowledge"}
+                filter_dict={"doc_type": "nutrition_knowledge"},
+                query_embedding=query_embedding
             )
             all_results.extend(knowledge_results)
             
@@ -268,33 +725,30 @@ class VectorStoreManager:
             if remaining > 0:
                 other_results = self.similarity_search(
                     query,
-                    n_results=remaining
+                    n_results=remaining,
+                    query_embedding=query_embedding
                 )
                 all_results.extend(other_results)
         
         else:
             # Balanced search across all document types
-            all_results = self.similarity_search(query, n_results=n_results)
+            all_results = self.similarity_search(query, n_results=n_results, query_embedding=query_embedding)
         
-        # Remove duplicates and sort by relevance
-        seen_ids = set()
-        unique_results = []
+        # Remove duplicates, keeping the best score per id
+        best = {}
         for result in all_results:
-            if result["id"] not in seen_ids:
-                unique_results.append(result)
-                seen_ids.add(result["id"])
+            if result["id"] not in best or result["similarity"] > best[result["id"]]["similarity"]:
+                best[result["id"]] = result
         
         # Sort by similarity score
-        unique_results.sort(key=lambda x: x["similarity"], reverse=True)
-        
-        return unique_results[:n_results]
+        return sorted(best.values(), key=itemgetter("similarity"), reverse=True)[:n_results]
 
 def test_vector_store():
     """Test the vector store functionality"""
     print("🧪 Testing Vector Store...")
     
     # Initialize vector store
-    vs = VectorStoreManager(use_local_embeddings=True)
+    vs = VectorStoreManager.get(use_local_embeddings=True)
     
     # Load and embed documents
     success = vs.load_and_embed_documents()
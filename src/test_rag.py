@@ -18,7 +18,7 @@ def test_complete_rag_system():
     try:
         from models.vector_store import VectorStoreManager
         
-        vs = VectorStoreManager(use_local_embeddings=True)
+        vs = VectorStoreManager.get(use_local_embeddings=True)
         stats = vs.get_collection_stats()
         print(f"   ✅ Vector store ready with {stats.get('total_documents', 0)} documents")
         
@@ -35,7 +35,7 @@ def test_complete_rag_system():
     try:
         from models.rag_engine import RAGQueryEngine
         
-        rag = RAGQueryEngine(use_local_embeddings=True)
+        rag = RAGQueryEngine.get(use_local_embeddings=True)
         
         test_queries = [
             "What are the best protein sources for muscle building?",
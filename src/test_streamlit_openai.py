@@ -6,6 +6,7 @@ Save as src/test_streamlit_openai.py
 import streamlit as st
 import sys
 import os
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
 import openai
@@ -18,6 +19,55 @@ load_dotenv(env_path)
 # Add current directory to path
 sys.path.append(str(Path(__file__).parent))
 
+from config.settings import settings
+from models.rate_limiter import RateLimiter, estimate_chat_tokens
+
+# Batch test limits (override in .env)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("OPENAI_MAX_CONCURRENT", "10"))
+BATCH_MODEL = "gpt-3.5-turbo"
+BATCH_MAX_TOKENS = 100
+
+async def run_batch(queries, api_key):
+    """Send test queries concurrently, paced by the shared RPM/TPM rate limiter"""
+    rate_limiter = get_rate_limiter()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    
+    async with openai.AsyncOpenAI(api_key=api_key) as client:
+        async def complete(query):
+            messages = [{"role": "user", "content": query}]
+            await rate_limiter.aacquire(estimate_chat_tokens(messages, BATCH_MODEL, BATCH_MAX_TOKENS))
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    model=BATCH_MODEL,
+                    messages=messages,
+                    max_tokens=BATCH_MAX_TOKENS
+                )
+            return response.choices[0].message.content
+        
+        return await asyncio.gather(*[complete(q) for q in queries], return_exceptions=True)
+
+@st.cache_resource
+def get_rate_limiter():
+    """OpenAI rate limiter shared across reruns and sessions"""
+    return RateLimiter(settings.openai_rpm_limit, settings.openai_tpm_limit)
+
+@st.cache_resource
+def get_vector_store():
+    """Vector store shared across reruns and sessions"""
+    from models.vector_store import VectorStoreManager
+    return VectorStoreManager.get(use_local_embeddings=True)
+
+@st.cache_resource
+def get_rag_engine():
+    """RAG engine shared across reruns and sessions"""
+    from models.rag_engine import RAGQueryEngine
+    return RAGQueryEngine.get(use_local_embeddings=True)
+
+@st.cache_data(ttl=3600)
+def cached_search(query, n_results):
+    """Vector search results memoized per (query, n_results) for an hour"""
+    return get_vector_store().similarity_search(query, n_results=n_results)
+
 st.set_page_config(page_title="🧪 OpenAI Test", page_icon="🧪")
 
 st.title("🧪 OpenAI Integration Test")
@@ -33,23 +83,27 @@ api_key = os.getenv('OPENAI_API_KEY')
 if api_key:
     st.success(f"✅ API Key found: {api_key[:10]}...{api_key[-4:]}")
     
-    # Test query
-    test_query = st.text_input("Test query:", "What is protein?")
+    # Test queries
+    test_input = st.text_area("Test queries (one per line):", "What is protein?")
+    test_queries = [q.strip() for q in test_input.splitlines() if q.strip()]
     
-    if st.button("🚀 Test OpenAI"):
+    if st.button("🚀 Test OpenAI") and test_queries:
         try:
-            with st.spinner("Testing OpenAI..."):
-                openai.api_key = api_key
-                
-                response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": test_query}],
-                    max_tokens=100
-                )
-                
+            with st.spinner(f"Testing OpenAI with {len(test_queries)} queries..."):
+                responses = asyncio.run(run_batch(test_queries, api_key))
+            
+            failures = [r for r in responses if isinstance(r, Exception)]
+            if failures:
+                st.error(f"❌ {len(failures)}/{len(responses)} queries failed")
+            else:
                 st.success("✅ OpenAI API working!")
-                st.write("**Response:**")
-                st.write(response.choices[0].message.content)
+            
+            for query, response in zip(test_queries, responses):
+                st.write(f"**{query}**")
+                if isinstance(response, Exception):
+                    st.error(f"❌ Error: {response}")
+                else:
+                    st.write(response)
                 
         except Exception as e:
             st.error(f"❌ Error: {e}")
@@ -58,10 +112,7 @@ if api_key:
     st.write("### RAG System Test")
     if st.button("🔍 Test Vector Search"):
         try:
-            from models.vector_store import VectorStoreManager
-            
-            vs = VectorStoreManager(use_local_embeddings=True)
-            results = vs.similarity_search("protein foods", n_results=3)
+            results = cached_search("protein foods", 3)
             
             st.success(f"✅ Found {len(results)} results")
             for i, result in enumerate(results, 1):
@@ -73,9 +124,7 @@ if api_key:
     # Test full RAG
     if st.button("🤖 Test Full RAG"):
         try:
-            from models.rag_engine import RAGQueryEngine
-            
-            rag = RAGQueryEngine(use_local_embeddings=True)
+            rag = get_rag_engine()
             response = rag.generate_response(
                 "What are good protein sources?", 
                 response_style="brief"
@@ -6,7 +6,9 @@ Handles path setup and common test utilities
 import pytest
 import sys
 import os
+import re
 from pathlib import Path
+from unittest.mock import AsyncMock, Mock
 from dotenv import load_dotenv
 
 # Setup paths for testing
@@ -17,11 +19,92 @@ env_path = project_root / '.env'
 # Add src to Python path
 sys.path.insert(0, str(src_path))
 
-# Load environment variables
+# Load environment variables (conftest is imported once per session)
 load_dotenv(env_path)
 
-# Change working directory to src for database access
-os.chdir(src_path)
+MOCK_LLM_RESPONSE = "mock response about protein, chicken, eggs"
+
+# Canned USDA FoodData Central payloads served by the mock_usda fixture
+MOCK_USDA_FDC_ID = 171077
+MOCK_USDA_NUTRIENTS = [
+    {'nutrient': {'name': 'Energy', 'unitName': 'kcal'}, 'amount': 165},
+    {'nutrient': {'name': 'Protein', 'unitName': 'g'}, 'amount': 31.0},
+    {'nutrient': {'name': 'Carbohydrate, by difference', 'unitName': 'g'}, 'amount': 0.0},
+    {'nutrient': {'name': 'Total lipid (fat)', 'unitName': 'g'}, 'amount': 3.6},
+    {'nutrient': {'name': 'Sodium, Na', 'unitName': 'mg'}, 'amount': 74}
+]
+
+def pytest_addoption(parser):
+    parser.addoption("--live", action="store_true", default=False,
+                     help="run tests marked live, and all tests, against the real OpenAI and USDA APIs")
+
+def pytest_configure(config):
+    """Change working directory to src for database access (once per session)"""
+    os.chdir(src_path)
+
+def pytest_collection_modifyitems(config, items):
+    """Skip live tests unless --live, and timing-sensitive tests on xdist workers"""
+    performance_dir = Path(__file__).parent / "performance"
+    for item in items:
+        if "benchmark" in item.keywords or performance_dir in item.path.parents:
+            item.add_marker(pytest.mark.serial)
+    
+    # Timings taken next to other workers' load are meaningless
+    if hasattr(config, "workerinput"):
+        skip_serial = pytest.mark.skip(reason="timing-sensitive, run with -p no:xdist")
+        for item in items:
+            if "serial" in item.keywords:
+                item.add_marker(skip_serial)
+    
+    if config.getoption("--live"):
+        return
+    skip_live = pytest.mark.skip(reason="needs --live")
+    for item in items:
+        if "live" in item.keywords:
+            item.add_marker(skip_live)
+
+@pytest.fixture(scope="session", autouse=True)
+def mock_usda(request, tmp_path_factory):
+    """
+    Serve canned USDA responses for the whole run, unless --live is given
+    
+    Other hosts pass through to the network. Responses are cached in a
+    session temp directory so canned data never reaches the real USDA cache.
+    """
+    if request.config.getoption("--live"):
+        yield None
+        return
+    
+    import diskcache
+    import requests_mock
+    from models import nutrition_api
+    
+    def search(req, context):
+        query = req.qs.get('query', ['food'])[0]
+        return {'foods': [{
+            'fdcId': MOCK_USDA_FDC_ID, 'description': query.capitalize(),
+            'dataType': 'SR Legacy', 'foodCategory': 'Mock Foods', 'score': 100
+        }]}
+    
+    def food(req, context):
+        fdc_id = int(req.path.rsplit('/', 1)[-1])
+        return {'fdcId': fdc_id, 'description': 'Mock food', 'dataType': 'SR Legacy',
+                'foodNutrients': MOCK_USDA_NUTRIENTS}
+    
+    real_disk_cache = nutrition_api._disk_cache
+    nutrition_api._disk_cache = diskcache.Cache(str(tmp_path_factory.mktemp("usda_cache")))
+    nutrition_api._disk_cache.stats(enable=True)
+    nutrition_api._search_foods_cached.cache_clear()
+    nutrition_api._food_details_cached.cache_clear()
+    
+    with requests_mock.Mocker(real_http=True) as mocker:
+        mocker.get(re.compile(r"https://api\.nal\.usda\.gov/fdc/v1/foods/search"), json=search)
+        mocker.get(re.compile(r"https://api\.nal\.usda\.gov/fdc/v1/food/\d+"), json=food)
+        yield mocker
+    
+    nutrition_api._disk_cache = real_disk_cache
+    nutrition_api._search_foods_cached.cache_clear()
+    nutrition_api._food_details_cached.cache_clear()
 
 @pytest.fixture(scope="session")
 def project_paths():
@@ -33,26 +116,73 @@ def project_paths():
         'env_path': env_path
     }
 
+@pytest.fixture(scope="session")
+def worker_lock(tmp_path_factory):
+    """
+    Lock shared by all pytest-xdist workers of a run
+    
+    Guards one-time setup that touches shared state (model download, the
+    ChromaDB directory); without xdist there is only one holder.
+    """
+    # Imported lazily: only fixtures that share setup across workers need it
+    from filelock import FileLock
+    
+    # getbasetemp() is per worker under xdist; its parent is shared by the run
+    return FileLock(str(tmp_path_factory.getbasetemp().parent / "nutrition_tests.lock"))
+
 @pytest.fixture(scope="session")  
-def ensure_database():
+def ensure_database(worker_lock):
     """Ensure the nutrition database is available for testing"""
     try:
         from models.vector_store import VectorStoreManager
         
-        vs = VectorStoreManager(use_local_embeddings=True)
-        stats = vs.get_collection_stats()
-        
-        if stats.get('total_documents', 0) == 0:
-            print("🔄 Initializing database for tests...")
-            success = vs.load_and_embed_documents()
-            if not success:
-                pytest.skip("Could not initialize nutrition database for testing")
+        # The first worker downloads the model and builds the database, the rest reuse them
+        with worker_lock:
+            vs = VectorStoreManager(use_local_embeddings=True)
+            stats = vs.get_collection_stats()
+            
+            if stats.get('total_documents', 0) == 0:
+                print("🔄 Initializing database for tests...")
+                success = vs.load_and_embed_documents()
+                if not success:
+                    pytest.skip("Could not initialize nutrition database for testing")
         
         return vs
         
     except Exception as e:
         pytest.skip(f"Database not available for testing: {e}")
 
+@pytest.fixture(scope="session")
+def vector_store(ensure_database):
+    """Session-wide vector store so the embedding model loads once per run"""
+    return ensure_database
+
+@pytest.fixture(scope="session")
+def rag_engine(vector_store):
+    """Session-wide RAG engine searching the session vector store"""
+    from models.rag_engine import RAGQueryEngine
+    return RAGQueryEngine(use_local_embeddings=True, vector_store=vector_store)
+
+@pytest.fixture
+def mock_openai(monkeypatch, rag_engine):
+    """Stub sync and async chat completions with a canned response"""
+    completion = Mock()
+    completion.choices = [Mock()]
+    completion.choices[0].message.content = MOCK_LLM_RESPONSE
+    
+    create = Mock(return_value=completion)
+    monkeypatch.setattr("openai.chat.completions.create", create)
+    
+    async_client = Mock()
+    async_client.chat.completions.create = AsyncMock(return_value=completion)
+    async_client.close = AsyncMock()
+    monkeypatch.setattr("openai.AsyncOpenAI", Mock(return_value=async_client))
+    
+    # Keep canned answers out of (and stale real ones away from) the shared engine
+    rag_engine.response_cache.clear()
+    yield create
+    rag_engine.response_cache.clear()
+
 @pytest.fixture
 def sample_user_profile():
     """Provide sample user profile for testing"""
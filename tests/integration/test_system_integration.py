@@ -6,21 +6,23 @@ Tests end-to-end workflows and component interactions
 import pytest
 import sys
 import os
+import re
 from pathlib import Path
 from unittest.mock import patch, Mock
 
 # Add src to path
 sys.path.append(str(Path(__file__).parent.parent.parent / 'src'))
 
+# "- item" lines of a vision model's food list
+_BULLET_RE = re.compile(r'^[ \t]*-[ \t]*(.+?)[ \t]*$', re.MULTILINE)
+
 class TestSystemIntegration:
     """Integration tests for complete system workflows"""
     
-    def test_complete_rag_pipeline(self):
-        """Test complete RAG pipeline from query to response"""
+    def test_complete_rag_pipeline(self, rag_engine, mock_openai):
+        """Test complete RAG pipeline from query to response (LLM mocked)"""
         try:
-            from models.rag_engine import RAGQueryEngine
-            
-            rag = RAGQueryEngine(use_local_embeddings=True)
+            rag = rag_engine
             
             # Test query that should work with your knowledge base
             query = "What are good protein sources?"
@@ -32,15 +34,73 @@ class TestSystemIntegration:
             assert 'search_strategy' in response
             assert 'context_count' in response
             
-            # Verify response quality
-            assert len(response['response']) > 10  # Non-empty response
+            # Retrieval ran for real; generation got the retrieved context
+            assert response['response'] == mock_openai.return_value.choices[0].message.content
             assert response['context_count'] >= 0
+            mock_openai.assert_called_once()
             
             print(f"✅ RAG Pipeline Test: {response['context_count']} sources used")
             
         except Exception as e:
             pytest.fail(f"RAG pipeline integration test failed: {e}")
     
+    @pytest.mark.live
+    def test_complete_rag_pipeline_live(self, rag_engine):
+        """Test complete RAG pipeline against the real OpenAI API"""
+        rag_engine.response_cache.clear()
+        response = rag_engine.generate_response("What are good protein sources?", response_style="brief")
+        
+        assert len(response['response']) > 10  # Non-empty response
+        assert response['context_count'] >= 0
+    
+    def test_rag_empty_query(self, rag_engine, mock_openai):
+        """Test that an empty query still yields a well-formed response"""
+        response = rag_engine.generate_response("", response_style="brief")
+        
+        assert 'response' in response
+        assert 'sources' in response
+    
+    def test_rag_llm_failure_fallback(self, rag_engine, mock_openai):
+        """Test that an OpenAI error degrades to the apology response and is not cached"""
+        from models.rag_engine import LLM_ERROR_RESPONSE
+        
+        mock_openai.side_effect = RuntimeError("API unavailable")
+        query = "What are good protein sources?"
+        
+        response = rag_engine.generate_response(query, response_style="brief")
+        assert response['response'] == LLM_ERROR_RESPONSE
+        
+        # Next call retries the LLM instead of replaying the failure
+        mock_openai.side_effect = None
+        response = rag_engine.generate_response(query, response_style="brief")
+        assert response['response'] == mock_openai.return_value.choices[0].message.content
+    
+    def test_rag_cached_response_is_a_copy(self, rag_engine, mock_openai):
+        """Test that mutating a returned response does not change the cached one"""
+        query = "What are good protein sources?"
+        
+        response = rag_engine.generate_response(query, response_style="brief")
+        response['sources'].append({'food_name': 'injected'})
+        for source in response['sources']:
+            source['food_name'] = 'changed'
+        
+        cached = rag_engine.generate_response(query, response_style="brief")
+        mock_openai.assert_called_once()
+        assert len(cached['sources']) == len(response['sources']) - 1
+        assert all(source.get('food_name') != 'changed' for source in cached['sources'])
+    
+    def test_rag_batch_inside_event_loop(self, rag_engine, mock_openai):
+        """Test that the sync batch API also works when called from a running event loop"""
+        import asyncio
+        
+        async def caller():
+            return rag_engine.generate_responses_batch([{"query": "What are good protein sources?"}])
+        
+        responses = asyncio.run(caller())
+        
+        assert len(responses) == 1
+        assert responses[0]['response'] == mock_openai.return_value.choices[0].message.content
+    
     def test_nutrition_api_integration(self):
         """Test USDA API integration with meal analysis"""
         try:
@@ -69,12 +129,10 @@ class TestSystemIntegration:
         except Exception as e:
             pytest.fail(f"Nutrition API integration test failed: {e}")
     
-    def test_vector_database_integration(self):
+    def test_vector_database_integration(self, vector_store):
         """Test vector database with actual nutrition queries"""
         try:
-            from models.vector_store import VectorStoreManager
-            
-            vs = VectorStoreManager(use_local_embeddings=True)
+            vs = vector_store
             
             # Test various query types
             test_queries = [
@@ -84,9 +142,11 @@ class TestSystemIntegration:
                 "vitamin deficiency"
             ]
             
-            for query in test_queries:
-                results = vs.similarity_search(query, n_results=3)
-                
+            # One encoder pass and one vector query for all queries
+            batch_results = vs.similarity_search_batch(test_queries, n_results=3)
+            assert len(batch_results) == len(test_queries)
+            
+            for query, results in zip(test_queries, batch_results):
                 assert isinstance(results, list)
                 assert len(results) <= 3
                 
@@ -95,6 +155,12 @@ class TestSystemIntegration:
                     assert 'metadata' in result
                     assert 'similarity' in result
                     assert isinstance(result['similarity'], (int, float))
+                
+                # Repeating the query is answered from the semantic cache
+                hits_before = vs.search_cache.hits
+                cached_results = vs.similarity_search(query, n_results=3)
+                assert vs.search_cache.hits == hits_before + 1
+                assert [r['id'] for r in cached_results] == [r['id'] for r in results]
             
             print(f"✅ Vector Database Integration: Tested {len(test_queries)} query types")
             
@@ -139,9 +205,7 @@ class TestSystemIntegration:
             vision_result = "- 6oz grilled chicken breast\n- 1 cup steamed broccoli"
             
             # Extract food descriptions (this is what your app does)
-            import re
-            food_lines = [line.strip() for line in vision_result.split('\n') if line.strip().startswith('-')]
-            food_descriptions = [line[1:].strip() for line in food_lines]
+            food_descriptions = _BULLET_RE.findall(vision_result)
             
             # Test meal analysis
             if food_descriptions:
@@ -159,12 +223,17 @@ def run_integration_tests():
     print("🔗 Running System Integration Tests...")
     print("=" * 50)
     
+    from models.vector_store import VectorStoreManager
+    from models.rag_engine import RAGQueryEngine
+    
     tester = TestSystemIntegration()
+    vector_store = VectorStoreManager.get(use_local_embeddings=True)
+    rag_engine = RAGQueryEngine(use_local_embeddings=True, vector_store=vector_store)
     
     try:
-        tester.test_complete_rag_pipeline()
+        tester.test_complete_rag_pipeline_live(rag_engine)
         tester.test_nutrition_api_integration()
-        tester.test_vector_database_integration()
+        tester.test_vector_database_integration(vector_store)
         tester.test_user_profile_workflow()
         tester.test_multimodal_workflow_mock()
         
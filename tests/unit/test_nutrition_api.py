@@ -12,23 +12,37 @@ from pathlib import Path
 # Add src to path for imports
 sys.path.append(str(Path(__file__).parent.parent.parent / 'src'))
 
+import diskcache
+
+from models import nutrition_api
 from models.nutrition_api import USDANutritionAPI
 
+@pytest.fixture(autouse=True)
+def isolated_usda_cache(tmp_path, monkeypatch):
+    """Keep mocked USDA responses out of the shared on-disk cache"""
+    monkeypatch.setattr(nutrition_api, '_disk_cache', diskcache.Cache(str(tmp_path / 'usda_cache')))
+    nutrition_api._disk_cache.stats(enable=True)
+    nutrition_api._search_foods_cached.cache_clear()
+    nutrition_api._food_details_cached.cache_clear()
+    yield
+    nutrition_api._search_foods_cached.cache_clear()
+    nutrition_api._food_details_cached.cache_clear()
+
+@pytest.fixture(scope="session")
+def api():
+    """API client shared by all tests (it holds no per-test state)"""
+    return USDANutritionAPI()
+
 class TestUSDANutritionAPI:
     """Test suite for USDA Nutrition API functionality"""
     
-    @pytest.fixture
-    def api(self):
-        """Create API instance for testing"""
-        return USDANutritionAPI()
-    
     def test_api_initialization(self, api):
         """Test that API initializes correctly"""
         assert api is not None
         assert api.base_url == "https://api.nal.usda.gov/fdc/v1"
         assert hasattr(api, 'api_key')
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_search_foods_success(self, mock_get, api):
         """Test successful food search"""
         # Mock API response
@@ -55,7 +69,44 @@ class TestUSDANutritionAPI:
         assert 'chicken' in results[0]['description'].lower()
         assert results[0]['score'] == 100
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
+    def test_search_foods_cached(self, mock_get, api):
+        """Test that repeated searches for the same normalized query hit the USDA API once"""
+        if not api.api_key:
+            pytest.skip("USDA API key not configured")
+        
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {'foods': [{'fdcId': 171077, 'description': 'Chicken breast'}]}
+        mock_get.return_value = mock_response
+        
+        first = api.search_foods("Chicken Breast", max_results=5)
+        second = api.search_foods("  chicken   breast ", max_results=5)
+        
+        assert first == second
+        mock_get.assert_called_once()
+        assert nutrition_api.cache_stats()['memory_hits'] == 1
+        
+        # Returned lists are copies of the cached entry
+        first[0]['description'] = 'changed'
+        assert api.search_foods("chicken breast", max_results=5)[0]['description'] == 'Chicken breast'
+    
+    @patch('requests.Session.get')
+    def test_disk_cache_keyed_by_endpoint(self, mock_get):
+        """Test that different USDA endpoints do not share cached searches"""
+        mock_response = Mock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {'foods': [{'fdcId': 171077, 'description': 'Chicken breast'}]}
+        mock_get.return_value = mock_response
+        
+        nutrition_api._search_foods_cached("https://api.nal.usda.gov/fdc/v1", "key", "chicken", 5)
+        # Skip the in-memory tier so the second lookup reaches the disk cache
+        nutrition_api._search_foods_cached.cache_clear()
+        nutrition_api._search_foods_cached("https://staging.example/fdc/v1", "key", "chicken", 5)
+        
+        assert mock_get.call_count == 2
+    
+    @patch('requests.Session.get')
     def test_search_foods_api_error(self, mock_get, api):
         """Test API error handling during search"""
         # Mock API error
@@ -68,7 +119,7 @@ class TestUSDANutritionAPI:
         # Should fallback to sample foods
         assert len(results) >= 0
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_food_details_success(self, mock_get, api):
         """Test successful food details retrieval"""
         # Mock detailed nutrition response
@@ -182,15 +233,46 @@ class TestUSDANutritionAPI:
         assert results[0]['original_description'] == "6oz chicken breast"
         assert 'nutrition' in results[0]
         assert 'portion' in results[0]
+    
+    @patch.object(USDANutritionAPI, 'search_foods')
+    @patch.object(USDANutritionAPI, 'get_food_details')
+    def test_analyze_meal_components_dedupes_lookups(self, mock_details, mock_search, api):
+        """Test that components naming the same food share one USDA lookup"""
+        mock_search.return_value = [{'fdc_id': 171077, 'description': 'Chicken breast', 'score': 100}]
+        mock_details.return_value = {
+            'food_name': 'Chicken breast',
+            'fdc_id': 171077,
+            'nutrients': {'calories': 165, 'protein_g': 31.0}
+        }
+        
+        results = api.analyze_meal_components(["6oz chicken breast", "200g chicken breast"])
+        
+        mock_search.assert_called_once_with("chicken breast", max_results=3)
+        mock_details.assert_called_once_with(171077)
+        assert [r['portion'] for r in results] == ["6.0 oz", "200.0 g"]
+        assert results[1]['nutrition']['calories'] == 330
+    
+    @patch.object(USDANutritionAPI, 'search_foods')
+    @patch.object(USDANutritionAPI, 'get_food_details')
+    def test_analyze_meal_components_inside_event_loop(self, mock_details, mock_search, api):
+        """Test that the sync API also works when called from a running event loop"""
+        import asyncio
+        
+        mock_search.return_value = [{'fdc_id': 171077, 'description': 'Chicken breast', 'score': 100}]
+        mock_details.return_value = {'food_name': 'Chicken breast', 'fdc_id': 171077, 'nutrients': {'calories': 165}}
+        
+        async def caller():
+            return api.analyze_meal_components(["6oz chicken breast"])
+        
+        results = asyncio.run(caller())
+        
+        assert len(results) == 1
+        assert results[0]['food_name'] == 'Chicken breast'
 
 
 class TestPerformanceMetrics:
     """Performance tests for nutrition API"""
     
-    @pytest.fixture
-    def api(self):
-        return USDANutritionAPI()
-    
     @pytest.mark.benchmark
     def test_search_performance(self, api, benchmark):
         """Benchmark food search performance"""
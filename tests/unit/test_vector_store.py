@@ -6,35 +6,61 @@ Tests embedding, storage, and similarity search capabilities
 import pytest
 import sys
 import os
-import tempfile
-import shutil
+import copy
 from pathlib import Path
 from unittest.mock import patch, Mock
 
+import chromadb
+import orjson
+import torch
+from cachetools import LRUCache
+from chromadb.config import Settings
+
 # Add src to path for imports
 sys.path.append(str(Path(__file__).parent.parent.parent / 'src'))
 
 from models.vector_store import VectorStoreManager
+from models.semantic_cache import SemanticCache
+
+@pytest.fixture(scope="session")
+def session_vector_store(tmp_path_factory, worker_lock):
+    """One vector store for the whole run, so the model and ChromaDB client load once"""
+    with worker_lock, patch('models.vector_store.Path') as mock_path:
+        # Mock the data path to use a temp directory
+        mock_path.return_value = tmp_path_factory.mktemp("processed")
+        return VectorStoreManager(use_local_embeddings=True)
+
+@pytest.fixture
+def mutable_vector_store(session_vector_store, tmp_path):
+    """
+    Per-test view of the session store that tests may modify
+    
+    Shares the loaded model and collection, but has its own search and query
+    embedding caches, FAISS index and data path, so changes do not leak into other tests.
+    """
+    vs = copy.copy(session_vector_store)
+    vs.data_path = tmp_path
+    vs.search_cache = SemanticCache(vs.embedding_dimension)
+    vs._query_embeddings = LRUCache(maxsize=64)
+    vs.faiss_index, vs._faiss_docs, vs._faiss_postings = None, [], {}
+    vs._exact_embeddings, vs._gpu_index = None, None
+    return vs
+
+@pytest.fixture
+def empty_vector_store(mutable_vector_store, tmp_path):
+    """Mutable store backed by its own empty ChromaDB, for tests that rebuild the collection"""
+    vs = mutable_vector_store
+    vs.client = chromadb.PersistentClient(path=str(tmp_path / "chroma_db"), settings=Settings(anonymized_telemetry=False))
+    vs.collection = vs._create_collection()
+    return vs
 
 class TestVectorStoreManager:
     """Test suite for Vector Store functionality"""
     
     @pytest.fixture
-    def temp_db_path(self):
-        """Create temporary database path for testing"""
-        temp_dir = tempfile.mkdtemp()
-        yield temp_dir
-        # Cleanup after test
-        shutil.rmtree(temp_dir, ignore_errors=True)
-    
-    @pytest.fixture
-    def vector_store(self, temp_db_path):
-        """Create vector store instance for testing"""
-        with patch('models.vector_store.Path') as mock_path:
-            # Mock the database path to use temp directory
-            mock_path.return_value = temp_db_path
-            vs = VectorStoreManager(use_local_embeddings=True)
-            return vs
+    def vector_store(self, session_vector_store):
+        """Shared vector store for tests that only read from it"""
+        return session_vector_store
     
     def test_initialization(self, vector_store):
         """Test vector store initialization"""
@@ -53,31 +79,79 @@ class TestVectorStoreManager:
         assert embeddings.shape[1] == 384  # Embedding dimension
         assert embeddings.dtype.name.startswith('float')  # Float values
     
+    def test_get_embeddings_dedupes_texts(self, vector_store):
+        """Test that repeated texts are encoded once and every row is filled in"""
+        texts = ["chicken breast", "broccoli", "chicken breast"]
+        
+        with patch.object(vector_store.embedding_model, 'encode', wraps=vector_store.embedding_model.encode) as mock_encode:
+            embeddings = vector_store.get_embeddings(texts)
+        
+        mock_encode.assert_called_once()
+        assert sorted(mock_encode.call_args[0][0]) == ["broccoli", "chicken breast"]
+        assert embeddings.shape == (3, 384)
+        assert (embeddings[0] == embeddings[2]).all()
+    
+    def test_embedding_model_shared(self, vector_store):
+        """Test that managers share one loaded embedding model"""
+        other = VectorStoreManager(use_local_embeddings=True)
+        assert other.embedding_model is vector_store.embedding_model
+    
     def test_embedding_similarity(self, vector_store):
         """Test that similar texts have similar embeddings"""
-        similar_texts = ["chicken breast", "chicken meat"]
-        different_texts = ["chicken breast", "apple fruit"]
+        import numpy as np
+        
+        def cosine_matrix(X):
+            Xn = X / np.linalg.norm(X, axis=1, keepdims=True)
+            return Xn @ Xn.T
         
-        similar_embeddings = vector_store.get_embeddings(similar_texts)
-        different_embeddings = vector_store.get_embeddings(different_texts)
+        # One encode and one matmul for all pairs
+        texts = ["chicken breast", "chicken meat", "apple fruit"]
+        similarities = cosine_matrix(vector_store.get_embeddings(texts))
         
-        # Calculate cosine similarity
-        def cosine_similarity(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+        # Similar texts should have higher similarity than different texts
+        assert similarities[0, 1] > similarities[0, 2]
+        
+        # Embeddings come back L2-normalized, so the plain Gram matrix is already cosine
+        embeddings = vector_store.get_embeddings(texts)
+        assert np.allclose(embeddings @ embeddings.T, similarities, atol=1e-5)
+    
+    def test_query_embeddings_cached(self, mutable_vector_store):
+        """Test that each distinct query is encoded once across calls"""
+        vs = mutable_vector_store
         
+        with patch.object(vs, 'get_embeddings', wraps=vs.get_embeddings) as mock_embed:
+            vs.warm_query_cache(["high protein foods", "vitamin C sources"])
+            embeddings = vs.embed_queries(["vitamin C sources", "high protein foods", "fiber", "fiber"])
+        
+        assert [call.args[0] for call in mock_embed.call_args_list] == [
+            ["high protein foods", "vitamin C sources"], ["fiber"]
+        ]
+        assert embeddings.shape == (4, 384)
+        assert (embeddings[2] == embeddings[3]).all()
+    
+    @pytest.mark.skipif(torch.cuda.is_available(), reason="int8 dynamic quantization is CPU-only; the model loads on GPU")
+    def test_quantized_embeddings_match_fp32(self, mutable_vector_store):
+        """Test that int8 quantization keeps embeddings close to the FP32 model"""
         import numpy as np
-        similar_score = cosine_similarity(similar_embeddings[0], similar_embeddings[1])
-        different_score = cosine_similarity(different_embeddings[0], different_embeddings[1])
+        from models.vector_store import _quantize_model, _is_quantized
         
-        # Similar texts should have higher similarity than different texts
-        assert similar_score > different_score
+        texts = ["chicken breast nutrition", "vitamin C sources", "post-workout protein"]
+        fp32_embeddings = mutable_vector_store.get_embeddings(texts)
+        
+        mutable_vector_store.embedding_model = _quantize_model(mutable_vector_store.embedding_model)
+        assert _is_quantized(mutable_vector_store.embedding_model)
+        int8_embeddings = mutable_vector_store.get_embeddings(texts)
+        
+        # Both are L2-normalized, so the row-wise dot product is the cosine similarity
+        agreement = np.sum(fp32_embeddings * int8_embeddings, axis=1)
+        assert np.all(agreement > 0.98)
     
-    @patch('json.load')
-    @patch('pathlib.Path.exists')
-    def test_load_and_embed_documents(self, mock_exists, mock_json_load, vector_store):
+    @patch('models.vector_store.orjson.loads')
+    @patch('pathlib.Path.read_bytes')
+    def test_load_and_embed_documents(self, mock_read_bytes, mock_json_load, empty_vector_store):
         """Test document loading and embedding process"""
         # Mock document data
-        mock_exists.return_value = True
+        mock_read_bytes.return_value = b"[]"
         mock_documents = [
             {
                 "id": "food_001",
@@ -101,23 +175,59 @@ class TestVectorStoreManager:
         ]
         mock_json_load.return_value = mock_documents
         
-        # Test loading
-        with patch.object(vector_store.collection, 'add') as mock_add:
-            success = vector_store.load_and_embed_documents()
+        # Loading recreates the collection, so hand it a mock one to inspect
+        mock_collection = Mock()
+        with patch.object(empty_vector_store.client, 'create_collection', return_value=mock_collection):
+            success = empty_vector_store.load_and_embed_documents()
             
             assert success == True
-            mock_add.assert_called_once()
+            assert empty_vector_store.collection is mock_collection
+            mock_collection.add.assert_called_once()
             
             # Verify the call arguments
-            call_args = mock_add.call_args
+            call_args = mock_collection.add.call_args
             assert len(call_args[1]['embeddings']) == 2
             assert len(call_args[1]['documents']) == 2
             assert len(call_args[1]['ids']) == 2
     
-    def test_similarity_search_basic(self, vector_store):
+    @patch('models.vector_store.EMBED_BATCH_SIZE', 2)
+    def test_load_and_embed_documents_in_batches(self, empty_vector_store):
+        """Test that documents are embedded and added to ChromaDB one batch at a time"""
+        (empty_vector_store.data_path / "comprehensive_documents.json").write_bytes(orjson.dumps([
+            {"id": f"food_{i:03d}", "type": "food_item", "content": f"Food number {i}", "metadata": {"food_name": f"Food {i}"}}
+            for i in range(5)
+        ]))
+        
+        with patch.object(empty_vector_store, 'get_embeddings', wraps=empty_vector_store.get_embeddings) as mock_embed:
+            assert empty_vector_store.load_and_embed_documents() == True
+        
+        assert [len(call.args[0]) for call in mock_embed.call_args_list] == [2, 2, 1]
+        assert empty_vector_store.collection.count() == 5
+        
+    @patch('pathlib.Path.read_bytes')
+    def test_embeddings_cached_between_loads(self, mock_read_bytes, empty_vector_store):
+        """Test that reloading unchanged documents skips re-encoding"""
+        mock_read_bytes.return_value = (
+            b'[{"id": "food_001", "type": "food_item", "content": "Chicken breast", '
+            b'"metadata": {"food_name": "Chicken Breast"}}]'
+        )
+        
+        assert empty_vector_store.load_and_embed_documents() == True
+        first = empty_vector_store.collection.get(ids=["food_001"], include=["embeddings"])["embeddings"][0]
+        
+        with patch.object(empty_vector_store, 'get_embeddings') as mock_embed:
+            assert empty_vector_store.load_and_embed_documents() == True
+            mock_embed.assert_not_called()
+        
+        # Cached copy is stored in fp16
+        import numpy as np
+        second = empty_vector_store.collection.get(ids=["food_001"], include=["embeddings"])["embeddings"][0]
+        assert np.allclose(first, second, atol=1e-3)
+    
+    def test_similarity_search_basic(self, mutable_vector_store):
         """Test basic similarity search functionality"""
         # Mock the collection query method
-        with patch.object(vector_store.collection, 'query') as mock_query:
+        with patch.object(mutable_vector_store.collection, 'query') as mock_query:
             mock_query.return_value = {
                 'documents': [['Chicken breast is high in protein']],
                 'metadatas': [[{'food_name': 'Chicken Breast', 'calories': '165'}]],
@@ -125,16 +235,16 @@ class TestVectorStoreManager:
                 'ids': [['food_001']]
             }
             
-            results = vector_store.similarity_search("high protein food", n_results=1)
+            results = mutable_vector_store.similarity_search("high protein food", n_results=1)
             
             assert len(results) == 1
             assert results[0]['content'] == 'Chicken breast is high in protein'
             assert results[0]['metadata']['food_name'] == 'Chicken Breast'
             assert results[0]['similarity'] > 0.7  # 1 - 0.2 = 0.8
     
-    def test_similarity_search_with_filter(self, vector_store):
+    def test_similarity_search_with_filter(self, mutable_vector_store):
         """Test similarity search with metadata filtering"""
-        with patch.object(vector_store.collection, 'query') as mock_query:
+        with patch.object(mutable_vector_store.collection, 'query') as mock_query:
             mock_query.return_value = {
                 'documents': [['High protein chicken breast nutrition']],
                 'metadatas': [[{'doc_type': 'food_item', 'food_name': 'Chicken'}]],
@@ -143,7 +253,7 @@ class TestVectorStoreManager:
             }
             
             # Test with filter
-            results = vector_store.similarity_search(
+            results = mutable_vector_store.similarity_search(
                 "protein", 
                 n_results=5, 
                 filter_dict={"doc_type": "food_item"}
@@ -157,6 +267,112 @@ class TestVectorStoreManager:
             call_args = mock_query.call_args
             assert call_args[1]['where'] == {"doc_type": "food_item"}
     
+    def test_search_ef_ignored_without_hnsw(self, mutable_vector_store):
+        """Test that search_ef does not split the semantic cache when no HNSW index reads it"""
+        with patch.object(mutable_vector_store.collection, 'query') as mock_query:
+            mock_query.return_value = {
+                'documents': [['Sample food document']],
+                'metadatas': [[{'doc_type': 'food_item'}]],
+                'distances': [[0.3]],
+                'ids': [['food_001']]
+            }
+            mutable_vector_store.similarity_search("protein", n_results=5)
+            mutable_vector_store.similarity_search("protein", n_results=5, search_ef=200)
+            
+            mock_query.assert_called_once()
+    
+    def test_faiss_backend_matches_chroma(self, mutable_vector_store):
+        """Test that the FAISS HNSW index returns the same top hits as ChromaDB"""
+        if mutable_vector_store.collection.count() == 0:
+            pytest.skip("Empty collection")
+        
+        query = "high protein foods"
+        chroma_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        with patch('models.vector_store.settings.faiss_index_type', 'hnsw'):
+            mutable_vector_store._build_faiss_index()
+        mutable_vector_store.search_cache.clear()
+        faiss_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        assert [r['id'] for r in faiss_results] == [r['id'] for r in chroma_results]
+        for faiss_result, chroma_result in zip(faiss_results, chroma_results):
+            assert faiss_result['similarity'] == pytest.approx(chroma_result['similarity'], abs=1e-4)
+    
+    def test_exact_search_matches_chroma(self, mutable_vector_store):
+        """Test that the brute-force matmul path returns the same top hits as ChromaDB"""
+        if mutable_vector_store.collection.count() == 0:
+            pytest.skip("Empty collection")
+        
+        query = "high protein foods"
+        chroma_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        with patch('models.vector_store.settings.faiss_index_type', 'exact'):
+            mutable_vector_store._build_faiss_index()
+        assert mutable_vector_store.faiss_index is None
+        mutable_vector_store.search_cache.clear()
+        exact_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        assert [r['id'] for r in exact_results] == [r['id'] for r in chroma_results]
+        for exact_result, chroma_result in zip(exact_results, chroma_results):
+            assert exact_result['similarity'] == pytest.approx(chroma_result['similarity'], abs=1e-4)
+    
+    def test_index_embeddings_memory_mapped(self, empty_vector_store):
+        """Test that the index memory-maps the fp16 embedding cache instead of reading ChromaDB"""
+        import numpy as np
+        
+        (empty_vector_store.data_path / "comprehensive_documents.json").write_bytes(
+            b'[{"id": "food_002", "type": "food_item", "content": "Broccoli", "metadata": {"food_name": "Broccoli"}}, '
+            b'{"id": "food_001", "type": "food_item", "content": "Chicken breast", "metadata": {"food_name": "Chicken"}}]'
+        )
+        assert empty_vector_store.load_and_embed_documents() == True
+        
+        with patch('models.vector_store.settings.faiss_index_type', 'exact'):
+            empty_vector_store._build_faiss_index()
+        
+        assert isinstance(empty_vector_store._exact_embeddings, np.memmap)
+        assert [doc[0] for doc in empty_vector_store._faiss_docs] == ["food_001", "food_002"]
+        results = empty_vector_store.similarity_search("broccoli", n_results=1)
+        assert results[0]['id'] == "food_002"
+        
+        # Edited source documents hash to a different cache file, so the old one is not reused
+        (empty_vector_store.data_path / "comprehensive_documents.json").write_bytes(
+            b'[{"id": "food_001", "type": "food_item", "content": "Chicken thigh", "metadata": {"food_name": "Chicken"}}, '
+            b'{"id": "food_002", "type": "food_item", "content": "Broccoli", "metadata": {"food_name": "Broccoli"}}]'
+        )
+        with patch('models.vector_store.settings.faiss_index_type', 'exact'):
+            empty_vector_store._build_faiss_index()
+        
+        assert not isinstance(empty_vector_store._exact_embeddings, np.memmap)
+    
+    def test_faiss_sq8_matches_chroma(self, mutable_vector_store):
+        """Test that the 8-bit scalar-quantized index keeps ChromaDB's top hit"""
+        if mutable_vector_store.collection.count() == 0:
+            pytest.skip("Empty collection")
+        
+        query = "high protein foods"
+        chroma_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        with patch('models.vector_store.settings.faiss_index_type', 'sq8'):
+            mutable_vector_store._build_faiss_index()
+        mutable_vector_store.search_cache.clear()
+        sq8_results = mutable_vector_store.similarity_search(query, n_results=3)
+        
+        assert sq8_results[0]['id'] == chroma_results[0]['id']
+        assert sq8_results[0]['similarity'] == pytest.approx(chroma_results[0]['similarity'], abs=0.02)
+    
+    def test_faiss_backend_filtered_search(self, mutable_vector_store):
+        """Test that FAISS equality filters only return matching documents"""
+        if mutable_vector_store.collection.count() == 0:
+            pytest.skip("Empty collection")
+        
+        mutable_vector_store._build_faiss_index()
+        filter_dict = {"doc_type": "food_item"}
+        results = mutable_vector_store.similarity_search("protein", n_results=5, filter_dict=filter_dict)
+        
+        assert results
+        for result in results:
+            assert result['metadata']['doc_type'] == 'food_item'
+    
     def test_hybrid_search_food_focus(self, vector_store):
         """Test hybrid search with food focus"""
         with patch.object(vector_store, 'similarity_search') as mock_search:
@@ -178,30 +394,68 @@ class TestVectorStoreManager:
     def test_get_collection_stats(self, vector_store):
         """Test collection statistics retrieval"""
         with patch.object(vector_store.collection, 'count') as mock_count:
-            with patch.object(vector_store.collection, 'query') as mock_query:
+            with patch.object(vector_store.collection, 'peek') as mock_peek:
                 mock_count.return_value = 66
-                mock_query.return_value = {
-                    'metadatas': [[
+                mock_peek.return_value = {
+                    'metadatas': [
                         {'doc_type': 'food_item'},
                         {'doc_type': 'food_item'},
                         {'doc_type': 'nutrition_knowledge'}
-                    ]]
+                    ]
                 }
                 
                 stats = vector_store.get_collection_stats()
                 
+                mock_peek.assert_called_once_with(limit=20)
                 assert stats['total_documents'] == 66
+                assert stats['document_types'] == {'food_item': 2, 'nutrition_knowledge': 1}
                 assert stats['embedding_model'] == 'local (all-MiniLM-L6-v2)'
                 assert stats['embedding_dimension'] == 384
                 assert 'document_types' in stats
 
 
+class TestSemanticCache:
+    """Test suite for the semantic search cache"""
+    
+    @pytest.fixture
+    def embedding(self):
+        import numpy as np
+        return np.random.default_rng(0).standard_normal(384)
+    
+    def test_near_duplicate_query_hits(self, embedding):
+        """Embeddings above the similarity threshold reuse cached results"""
+        cache = SemanticCache(384, similarity_threshold=0.95)
+        cache.set(embedding, [{'id': 'food_001'}], namespace=5)
+        
+        assert cache.get(embedding * 1.01 + 0.001, namespace=5) == [{'id': 'food_001'}]
+        assert cache.get(-embedding, namespace=5) is None
+        assert cache.stats()['hits'] == 1
+    
+    def test_namespace_must_match(self, embedding):
+        """Results are only reused for the same search parameters"""
+        cache = SemanticCache(384)
+        cache.set(embedding, [{'id': 'food_001'}], namespace=(5, None))
+        
+        assert cache.get(embedding, namespace=(3, None)) is None
+    
+    def test_lru_eviction(self, embedding):
+        """Least recently used entries are evicted beyond max_entries"""
+        import numpy as np
+        cache = SemanticCache(384, max_entries=1)
+        cache.set(embedding, ['first'])
+        cache.set(np.ones(384), ['second'])
+        
+        assert cache.get(embedding) is None
+        assert cache.get(np.ones(384)) == ['second']
+        assert cache.stats()['entries'] == 1
+
+
 class TestVectorStorePerformance:
     """Performance tests for vector store operations"""
     
     @pytest.fixture
-    def vector_store(self):
-        return VectorStoreManager(use_local_embeddings=True)
+    def vector_store(self, session_vector_store):
+        return session_vector_store
     
     @pytest.mark.benchmark
     def test_embedding_generation_performance(self, vector_store, benchmark):
@@ -216,9 +470,9 @@ class TestVectorStorePerformance:
         assert result.shape[1] == 384
     
     @pytest.mark.benchmark
-    def test_similarity_search_performance(self, vector_store, benchmark):
+    def test_similarity_search_performance(self, mutable_vector_store, benchmark):
         """Benchmark similarity search speed"""
-        with patch.object(vector_store.collection, 'query') as mock_query:
+        with patch.object(mutable_vector_store.collection, 'query') as mock_query:
             mock_query.return_value = {
                 'documents': [['Sample food document']],
                 'metadatas': [[{'doc_type': 'food_item'}]],
@@ -227,10 +481,41 @@ class TestVectorStorePerformance:
             }
             
             def search_operation():
-                return vector_store.similarity_search("protein", n_results=5)
+                # Clear the semantic cache so every round reaches the index
+                mutable_vector_store.search_cache.clear()
+                return mutable_vector_store.similarity_search("protein", n_results=5)
             
             result = benchmark(search_operation)
             assert len(result) == 1
+    
+    @pytest.mark.benchmark
+    def test_similarity_search_cache_hit_performance(self, mutable_vector_store, benchmark):
+        """Benchmark similarity search served by the semantic cache"""
+        mutable_vector_store.similarity_search("protein", n_results=5)
+        
+        with patch.object(mutable_vector_store, '_query') as mock_query:
+            result = benchmark(mutable_vector_store.similarity_search, "protein", n_results=5)
+            mock_query.assert_not_called()
+        assert isinstance(result, list)
+    
+    def test_cached_results_are_copies(self, mutable_vector_store):
+        """Test that mutating returned results does not change what the cache serves"""
+        with patch.object(mutable_vector_store.collection, 'query') as mock_query:
+            mock_query.return_value = {
+                'documents': [['Sample food document']],
+                'metadatas': [[{'doc_type': 'food_item'}]],
+                'distances': [[0.3]],
+                'ids': [['food_001']]
+            }
+            first = mutable_vector_store.similarity_search("protein", n_results=5)
+            first[0]['similarity'] = 0.0
+            first[0]['metadata']['doc_type'] = 'changed'
+            
+            second = mutable_vector_store.similarity_search("protein", n_results=5)
+        
+        mock_query.assert_called_once()
+        assert second[0]['similarity'] == pytest.approx(0.7)
+        assert second[0]['metadata']['doc_type'] == 'food_item'
 
 
 if __name__ == "__main__":